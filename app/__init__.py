@@ -1,3 +1,4 @@
+import importlib.util
 # import flask
 from flask import Flask
 # import expand package
@@ -7,6 +8,16 @@ from flask_migrate import Migrate
 from flask_socketio import SocketIO
 # import config
 from app.config import Config
+from app.cache import render_cache
+from app.scheduler import compile_scheduler
+from app.precheck import compile_precheck
+from app.executor import compile_executor
+from app.registry import session_registry
+from app.ratelimit import compile_rate_limiter
+from app.debounce import debounce_advisor
+from app.tracing import compile_tracer
+from app.workspace import workspace_pool
+from app.artifacts import artifact_store
 
 
 # create expand instance
@@ -28,14 +39,30 @@ def create_app(config_mode=Config):
     db.init_app(app)
     migrate.init_app(app, db)
     login_manager.init_app(app)
+    render_cache.init_app(app)
+    compile_precheck.init_app(app)
+    compile_rate_limiter.init_app(app)
+    debounce_advisor.init_app(app)
+    compile_tracer.init_app(app)
+    workspace_pool.init_app(app)
+    artifact_store.init_app(app)
+    message_queue = app.config.get('SOCKETIO_MESSAGE_QUEUE')
+    if message_queue and message_queue.startswith(('redis://', 'rediss://')) and importlib.util.find_spec('redis') is None:
+        raise RuntimeError('SOCKETIO_MESSAGE_QUEUE needs the redis package, install the redis extra: pip install ".[redis]"')
+    if app.config.get('TYPST_BACKEND') == 'engine' and importlib.util.find_spec('typst') is None:
+        raise RuntimeError('TYPST_BACKEND=engine needs the typst Python bindings, install the engine extra: pip install ".[engine]"')
     socketio.init_app(
         app,
         async_mode=app.config.get('SOCKETIO_ASYNC_MODE'),
         cors_allowed_origins="*",
         http_compression=False,
+        message_queue=message_queue,
         ping_timeout=60,
         ping_interval=25
     )
+    compile_scheduler.init_app(app, socketio)
+    compile_executor.init_app(app, socketio)
+    session_registry.init_app(app, socketio)
     
     # login config
     login_manager.login_view = "auth.login"
@@ -0,0 +1,50 @@
+import os
+import hashlib
+import threading
+
+
+class ArtifactStore:
+    """Content-Addressed Store of rendered Favorites on the Filesystem"""
+    def __init__(self, root=None):
+        self.root = root
+
+    def init_app(self, app):
+        """read artifact config, defaults to the instance folder"""
+        self.root = app.config.get('ARTIFACT_DIR') or os.path.join(app.instance_path, 'artifacts')
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def make_key(content):
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def path(self, key, output_format='svg'):
+        return os.path.join(self.root, key[:2], f"{key}.{output_format}")
+
+    def exists(self, key, output_format='svg'):
+        return bool(key) and os.path.exists(self.path(key, output_format))
+
+    def put(self, content, output_format='svg'):
+        """store a rendered artifact, return its key"""
+        key = self.make_key(content)
+        path = self.path(key, output_format)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            partial_path = f"{path}.{threading.get_ident()}.partial"
+            with open(partial_path, 'w', encoding='utf-8') as f:
+                f.write(content)
+            os.replace(partial_path, path)
+        return key
+
+    def read(self, key, output_format='svg'):
+        with open(self.path(key, output_format), 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def delete(self, key, output_format='svg'):
+        try:
+            os.unlink(self.path(key, output_format))
+        except FileNotFoundError:
+            pass
+
+
+# shared artifact store instance
+artifact_store = ArtifactStore()
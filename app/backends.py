@@ -0,0 +1,568 @@
+import os
+import re
+import time
+import queue
+import weakref
+import threading
+import subprocess
+import importlib.util
+import multiprocessing
+from app.tracing import compile_tracer
+from app.workspace import workspace_pool
+
+# ANSI escape sequences printed by `typst watch`
+ANSI_ESCAPE = re.compile(r'\x1b\[[0-9;?]*[A-Za-z]')
+
+
+class CompileCancelled(Exception):
+    """A newer compile of the same session superseded this one"""
+
+
+class TypstRun:
+    """One `typst compile` child and its cancel flag, per call"""
+    __slots__ = ('process', 'cancelled')
+
+    def __init__(self, process):
+        self.process = process
+        self.cancelled = False
+
+
+class CompileBackend:
+    """
+    Compile Backend Interface
+
+    compile(full_code) returns (success, svg or error message) and raises
+    subprocess.TimeoutExpired, CompileCancelled or FileNotFoundError,
+    after cleanup() it raises CompileCancelled
+
+    compile_document(files, main) compiles a multi-file document and returns
+    (success, svg per page or error message), backends without it raise NotImplementedError
+    """
+    # workspace of this backend, None if it works without files
+    temp_dir = None
+    # backend caches results itself, skip the local render cache
+    shared_cache = False
+    # set by cleanup(), the workspace may already belong to another session
+    closed = False
+
+    def compile(self, full_code):
+        raise NotImplementedError
+
+    def compile_document(self, files, main):
+        raise NotImplementedError
+
+    def cancel(self):
+        """supersede the running compile"""
+
+    def cleanup(self):
+        """release processes, the workspace goes back to the pool"""
+        self.closed = True
+        self.cancel()
+        self._release_workspace()
+
+    def _release_workspace(self):
+        temp_dir, self.temp_dir = self.temp_dir, None
+        if temp_dir and os.path.exists(temp_dir):
+            workspace_pool.release(temp_dir)
+
+
+class CliBackend(CompileBackend):
+    """One `typst compile` Process per Compile"""
+    def __init__(self, typst_path='typst', timeout=5, io_mode='file'):
+        self.typst_path = typst_path
+        self.timeout = timeout
+        # pipe mode: source over stdin, SVG from stdout, no workspace needed
+        self.io_mode = 'pipe' if io_mode == 'pipe' else 'file'
+        self.temp_dir = workspace_pool.acquire() if self.io_mode == 'file' else None
+        # running typst children, killed when superseded
+        self.runs = set()
+        self.runs_lock = threading.Lock()
+        # compiles of one session share input.typ / output.svg
+        self.lock = threading.Lock()
+
+    def compile(self, full_code):
+        if self.closed:
+            raise CompileCancelled()
+
+        # compile over pipes
+        if self.io_mode == 'pipe':
+            with compile_tracer.phase('exec'):
+                returncode, svg_content, stderr = self._run_typst(['-', '-'], full_code)
+            if returncode == 0 and svg_content:
+                return True, svg_content
+            return False, stderr or "Compile Failed"
+
+        with self.lock:
+            # closed while waiting for the lock, the workspace is gone
+            if self.closed:
+                raise CompileCancelled()
+            input_file = os.path.join(self.temp_dir, "input.typ")
+            output_file = os.path.join(self.temp_dir, "output.svg")
+
+            # write Typst Code
+            with compile_tracer.phase('write'), open(input_file, 'w', encoding='utf-8') as f:
+                f.write(full_code)
+
+            # run typst compile
+            with compile_tracer.phase('exec'):
+                returncode, _, stderr = self._run_typst([input_file, output_file])
+
+            # check result
+            if returncode == 0 and os.path.exists(output_file):
+                # read SVG file
+                with compile_tracer.phase('read'), open(output_file, 'r', encoding='utf-8') as f:
+                    svg_content = f.read()
+                return True, svg_content
+
+        return False, stderr or "Compile Failed"
+
+    def cancel(self):
+        """kill the running typst children, their compiles raise CompileCancelled"""
+        with self.runs_lock:
+            runs = list(self.runs)
+        for run in runs:
+            if run.process.poll() is None:
+                run.cancelled = True
+                run.process.kill()
+
+    def compile_document(self, files, main):
+        """one typst run over {name: source} files, pages go to separate SVGs"""
+        if self.closed:
+            raise CompileCancelled()
+        workspace = workspace_pool.acquire()
+        try:
+            with compile_tracer.phase('write'):
+                for name, source in files.items():
+                    with open(os.path.join(workspace, name), 'w', encoding='utf-8') as f:
+                        f.write(source)
+
+            with compile_tracer.phase('exec'):
+                returncode, _, stderr = self._run_typst([
+                    os.path.join(workspace, main),
+                    os.path.join(workspace, 'page-{p}.svg')
+                ])
+            if returncode != 0:
+                return False, stderr.replace(workspace + os.sep, '') or "Compile Failed"
+
+            # pages are numbered from 1
+            pages = []
+            with compile_tracer.phase('read'):
+                while True:
+                    page_file = os.path.join(workspace, f'page-{len(pages) + 1}.svg')
+                    if not os.path.exists(page_file):
+                        break
+                    with open(page_file, 'r', encoding='utf-8') as f:
+                        pages.append(f.read())
+            return True, pages
+        finally:
+            workspace_pool.release(workspace)
+
+    def cleanup(self):
+        # a child still writing would leak into the next owner of the workspace,
+        # a compile holding the lock stops before the workspace goes back
+        self.closed = True
+        self.cancel()
+        with self.lock:
+            self._release_workspace()
+
+    def _run_typst(self, paths, stdin=None):
+        """
+        run `typst compile`, return (returncode, stdout, stderr)
+
+        a child killed by cancel() or by a signal raises CompileCancelled,
+        its output says nothing about the source and must not be cached
+        """
+        process = subprocess.Popen(
+            [self.typst_path, 'compile', *paths, '--format', 'svg'],
+            stdin=subprocess.PIPE if stdin is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            encoding='utf-8'
+        )
+        run = TypstRun(process)
+        with self.runs_lock:
+            self.runs.add(run)
+            # started after cleanup() killed the running children
+            if self.closed:
+                run.cancelled = True
+                process.kill()
+        try:
+            stdout, stderr = process.communicate(input=stdin, timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            raise
+        finally:
+            with self.runs_lock:
+                self.runs.discard(run)
+        if run.cancelled or process.returncode < 0:
+            raise CompileCancelled()
+        return process.returncode, stdout, stderr
+
+
+# Live Watch Backends (for idle shutdown)
+_watch_backends = weakref.WeakSet()
+_reaper_lock = threading.Lock()
+_reaper_started = False
+
+
+class WatchBackend(CompileBackend):
+    """Managed `typst watch` Child of one Compiler Workspace"""
+    def __init__(self, typst_path='typst', timeout=5, idle_timeout=300, warmup_code='', cancel_grace=0.2):
+        self.typst_path = typst_path
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.warmup_code = warmup_code
+        self.cancel_grace = cancel_grace
+        self.temp_dir = workspace_pool.acquire()
+        self.input_file = os.path.join(self.temp_dir, "input.typ")
+        self.output_file = os.path.join(self.temp_dir, "output.svg")
+        self.process = None
+        self.restart_count = 0
+        self.last_used = time.monotonic()
+        # compile state, written by the stderr reader
+        self.lock = threading.Lock()
+        self.condition = threading.Condition()
+        self.generation = 0
+        self.status = None
+        self.diagnostics = []
+        self.cancel_requested = False
+        # generation of a cancelled compile still running in the child
+        self.pending_generation = None
+        # last compiled source and its result
+        self.last_code = None
+        self.last_result = None
+        _watch_backends.add(self)
+        _start_reaper()
+
+    def start(self):
+        """start `typst watch` and wait for the warm-up compile"""
+        # typst watch needs an existing input file
+        self._write_source(self.warmup_code)
+        with self.condition:
+            generation = self.generation
+        self.process = subprocess.Popen(
+            [self.typst_path, 'watch', self.input_file, self.output_file, '--format', 'svg'],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+            encoding='utf-8',
+            errors='replace'
+        )
+        reader = threading.Thread(target=self._read_stderr, args=(self.process,), daemon=True)
+        reader.start()
+        # font discovery and the prelude parse happen here, not on the first keystroke
+        self._wait_status(generation)
+        self.last_code = None
+        self.last_result = None
+
+    def stop(self):
+        """stop `typst watch`"""
+        process = self.process
+        self.process = None
+        if process and process.poll() is None:
+            process.kill()
+            try:
+                process.wait(timeout=1)
+            except subprocess.TimeoutExpired:
+                pass
+
+    def cleanup(self):
+        # wake a compile waiting for a status line, it must not restart the child
+        # once the workspace goes back to the pool
+        self.closed = True
+        self.cancel()
+        with self.lock:
+            self.stop()
+            self._release_workspace()
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def is_idle(self):
+        return time.monotonic() - self.last_used > self.idle_timeout
+
+    def compile(self, full_code):
+        with self.lock:
+            if self.closed:
+                raise CompileCancelled()
+            self.last_used = time.monotonic()
+
+            # identical source: typst watch may not recompile
+            if full_code == self.last_code and self.is_alive():
+                return self.last_result
+
+            # let a superseded compile finish, so its status is not taken for ours,
+            # a child still busy after the grace period is killed and restarted
+            with self.condition:
+                self.cancel_requested = False
+                pending_generation = self.pending_generation
+                self.pending_generation = None
+            if pending_generation is not None and not self._wait_status(pending_generation, self.cancel_grace):
+                self.stop()
+
+            # supervised (re)start, never after cleanup()
+            if self.closed:
+                raise CompileCancelled()
+            if not self.is_alive():
+                if self.process is not None or self.restart_count:
+                    print(f'[Typst Worker] Restart Worker | Workspace: "{self.temp_dir}" | Restarts: {self.restart_count}')
+                self.restart_count += 1
+                self.stop()
+                self.start()
+
+            # write source, then wait for the next status line
+            with self.condition:
+                generation = self.generation
+            with compile_tracer.phase('write'):
+                self._write_source(full_code)
+            with compile_tracer.phase('exec'):
+                compiled = self._wait_status(generation)
+            if not compiled:
+                if self.cancel_requested or self.closed:
+                    self.pending_generation = generation
+                    raise CompileCancelled()
+                # a hung child is killed, next compile restarts it
+                self.stop()
+                raise subprocess.TimeoutExpired('typst watch', self.timeout)
+
+            # check result
+            if self.status == 'error':
+                self._wait_diagnostics()
+                result = (False, "\n".join(self.diagnostics).strip() or "Compile Failed")
+            else:
+                with compile_tracer.phase('read'), open(self.output_file, 'r', encoding='utf-8') as f:
+                    result = (True, f.read())
+
+            self.last_code = full_code
+            self.last_result = result
+            self.last_used = time.monotonic()
+            return result
+
+    def cancel(self):
+        """abandon the compile waiting for a status line, the child keeps running"""
+        with self.condition:
+            self.cancel_requested = True
+            self.condition.notify_all()
+
+    def _write_source(self, full_code):
+        """atomic write, so typst watch never sees a half-written file"""
+        partial_file = self.input_file + ".partial"
+        with open(partial_file, 'w', encoding='utf-8') as f:
+            f.write(full_code)
+        os.replace(partial_file, self.input_file)
+
+    def _wait_status(self, generation, timeout=None):
+        """wait for a status line newer than generation"""
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: self.generation > generation or self.cancel_requested or self.closed or not self.is_alive(),
+                timeout=timeout or self.timeout
+            ) and self.generation > generation
+
+    def _wait_diagnostics(self, settle=0.02):
+        """diagnostics follow the status line, wait until they stop arriving"""
+        with self.condition:
+            count = -1
+            while count != len(self.diagnostics):
+                count = len(self.diagnostics)
+                self.condition.wait(timeout=settle)
+
+    def _read_stderr(self, process):
+        """parse `typst watch` status lines and diagnostics"""
+        for line in process.stderr:
+            line = ANSI_ESCAPE.sub('', line).rstrip()
+            with self.condition:
+                if 'compiled with errors' in line:
+                    self.status = 'error'
+                    self.diagnostics = []
+                    self.generation += 1
+                elif 'compiled successfully' in line or 'compiled with warnings' in line:
+                    self.status = 'success'
+                    self.diagnostics = []
+                    self.generation += 1
+                elif self.status == 'error':
+                    self.diagnostics.append(line)
+                self.condition.notify_all()
+        with self.condition:
+            self.condition.notify_all()
+
+
+def _start_reaper(interval=30):
+    """start the idle shutdown thread once per process"""
+    global _reaper_started
+    with _reaper_lock:
+        if _reaper_started:
+            return
+        _reaper_started = True
+
+    def reap():
+        while True:
+            time.sleep(interval)
+            for backend in list(_watch_backends):
+                # skip backends in the middle of a compile
+                if not backend.closed and backend.is_alive() and backend.is_idle() and backend.lock.acquire(blocking=False):
+                    try:
+                        backend.stop()
+                        print(f'[Typst Worker] Idle Shutdown | Workspace: "{backend.temp_dir}"')
+                    finally:
+                        backend.lock.release()
+
+    threading.Thread(target=reap, name='typst-worker-reaper', daemon=True).start()
+
+
+def _engine_main(conn, warmup_code):
+    """engine process: one resident typst.Compiler, fonts and prelude stay in memory"""
+    import typst
+
+    compiler = typst.Compiler()
+    try:
+        compiler.compile(input=warmup_code.encode('utf-8'), format='svg')
+    except Exception:
+        pass
+
+    while True:
+        try:
+            full_code = conn.recv()
+        except EOFError:
+            break
+        if full_code is None:
+            break
+        try:
+            output = compiler.compile(input=full_code.encode('utf-8'), format='svg')
+            if isinstance(output, list):
+                if len(output) != 1:
+                    conn.send((False, 'error: cannot export multiple pages to one SVG'))
+                    continue
+                output = output[0]
+            conn.send((True, output.decode('utf-8')))
+        except typst.TypstError as e:
+            conn.send((False, e.diagnostic or e.message))
+        except Exception as e:
+            conn.send((False, f'error: {e}'))
+
+
+class TypstEngineProcess:
+    """Resident Worker Process running the typst Python Bindings"""
+    def __init__(self, warmup_code=''):
+        self.warmup_code = warmup_code
+        self.process = None
+        self.conn = None
+        # a cancelled compile is still running in the process
+        self.pending = False
+
+    def start(self):
+        context = multiprocessing.get_context('spawn')
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_engine_main,
+            args=(child_conn, self.warmup_code),
+            name='typst-engine',
+            daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.pending = False
+
+    def stop(self):
+        process = self.process
+        self.process = None
+        if process and process.is_alive():
+            process.kill()
+            process.join(timeout=1)
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+    def is_alive(self):
+        return self.process is not None and self.process.is_alive()
+
+
+class EnginePool:
+    """Shared Pool of Typst Engine Processes"""
+    def __init__(self, size, warmup_code=''):
+        self.size = size
+        self.idle = queue.Queue()
+        for _ in range(size):
+            self.idle.put(TypstEngineProcess(warmup_code))
+
+    def acquire(self):
+        return self.idle.get()
+
+    def release(self, engine):
+        self.idle.put(engine)
+
+
+_engine_pool = None
+_engine_pool_lock = threading.Lock()
+
+
+def get_engine_pool(size, warmup_code=''):
+    """create the shared engine pool once per process"""
+    global _engine_pool
+    with _engine_pool_lock:
+        if _engine_pool is None:
+            _engine_pool = EnginePool(size, warmup_code)
+        return _engine_pool
+
+
+class EngineBackend(CompileBackend):
+    """In-Process Typst Engine, run in resident Worker Processes for the Timeout"""
+    def __init__(self, timeout=5, processes=1, warmup_code='', cancel_grace=0.2, poll_interval=0.05):
+        self.timeout = timeout
+        self.processes = processes
+        self.warmup_code = warmup_code
+        self.cancel_grace = cancel_grace
+        self.poll_interval = poll_interval
+        self.cancel_requested = False
+
+    def compile(self, full_code):
+        if self.closed:
+            raise CompileCancelled()
+        if importlib.util.find_spec('typst') is None:
+            raise RuntimeError('typst Python Bindings are not installed, install the engine extra: pip install ".[engine]"')
+
+        pool = get_engine_pool(self.processes, self.warmup_code)
+        engine = pool.acquire()
+        try:
+            self.cancel_requested = False
+            self._prepare(engine)
+            with compile_tracer.phase('write'):
+                engine.conn.send(full_code)
+
+            # wait for the result, in slices so a newer compile can supersede it
+            with compile_tracer.phase('exec'):
+                deadline = time.monotonic() + self.timeout
+                while not engine.conn.poll(self.poll_interval):
+                    if self.cancel_requested:
+                        engine.pending = True
+                        raise CompileCancelled()
+                    if time.monotonic() > deadline or not engine.is_alive():
+                        # a hung engine is killed, next compile restarts it
+                        engine.stop()
+                        raise subprocess.TimeoutExpired('typst engine', self.timeout)
+            with compile_tracer.phase('read'):
+                return engine.conn.recv()
+        except (EOFError, OSError):
+            engine.stop()
+            raise
+        finally:
+            pool.release(engine)
+
+    def cancel(self):
+        """abandon the running compile, the engine process keeps running"""
+        self.cancel_requested = True
+
+    def _prepare(self, engine):
+        """drain a superseded compile, or (re)start the engine"""
+        if engine.is_alive() and engine.pending:
+            if engine.conn.poll(self.cancel_grace):
+                engine.conn.recv()
+                engine.pending = False
+            else:
+                engine.stop()
+        if not engine.is_alive():
+            engine.stop()
+            engine.start()
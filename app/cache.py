@@ -0,0 +1,206 @@
+import os
+import json
+import hashlib
+import threading
+import subprocess
+import importlib.metadata
+from collections import OrderedDict
+from app.svg import OPTIMIZER_VERSION
+
+
+def compiler_version(config):
+    """typst version of the configured backend, cached renders of another version are stale"""
+    if config.get('TYPST_BACKEND') == 'engine':
+        try:
+            return f"typst-py {importlib.metadata.version('typst')}"
+        except importlib.metadata.PackageNotFoundError:
+            return 'typst-py'
+    try:
+        return subprocess.run(
+            [config.get('TYPST_COMPILER_PATH') or 'typst', '--version'],
+            capture_output=True, text=True, timeout=10
+        ).stdout.strip()
+    except (OSError, subprocess.TimeoutExpired):
+        return 'typst'
+
+
+class RenderCache:
+    """Content-Addressed Render Cache shared by all Sessions"""
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_entries=4096, disk_dir=None, disk_max_bytes=1024 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        # typst and optimizer versions, disk entries outlive upgrades
+        self.salt = ''
+        self.lock = threading.Lock()
+        # {key: (success, output)}, least recently used first
+        self.entries = OrderedDict()
+        self.size = 0
+        # {key: file size} of the disk tier, least recently used first
+        self.disk_entries = OrderedDict()
+        self.disk_size = 0
+        # counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_hits = 0
+        self.disk_evictions = 0
+
+    def init_app(self, app):
+        """read cache config"""
+        self.max_bytes = app.config.get('RENDER_CACHE_MAX_BYTES', self.max_bytes)
+        self.max_entries = app.config.get('RENDER_CACHE_MAX_ENTRIES', self.max_entries)
+        self.disk_dir = app.config.get('RENDER_CACHE_DIR', self.disk_dir)
+        self.disk_max_bytes = app.config.get('RENDER_CACHE_DIR_MAX_BYTES', self.disk_max_bytes)
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self.salt = f"{compiler_version(app.config)}|svg-optimizer {OPTIMIZER_VERSION}|{app.config.get('RENDER_CACHE_SALT') or ''}"
+            self._scan_disk()
+
+    def make_key(self, full_code):
+        """hash of the full source, prelude included, and of the compiler versions"""
+        return hashlib.sha256(f'{self.salt}\0{full_code}'.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """return (success, output) or None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        # disk tier
+        entry = self._read_disk(key)
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self._store(key, entry)
+        return entry
+
+    def put(self, key, success, output):
+        """store a compile result"""
+        entry = (success, output)
+        with self.lock:
+            self._store(key, entry)
+        self._write_disk(key, entry)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        """cache counters"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'disk_hits': self.disk_hits,
+                'disk_evictions': self.disk_evictions,
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'disk_entries': len(self.disk_entries),
+                'disk_bytes': self.disk_size,
+                'hit_ratio': self.hits / lookups if lookups else 0.0
+            }
+
+    def _store(self, key, entry):
+        """insert into memory tier and evict LRU entries, lock held"""
+        entry_size = len(entry[1])
+        if entry_size > self.max_bytes:
+            return
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.size -= len(old[1])
+        self.entries[key] = entry
+        self.size += entry_size
+        while self.size > self.max_bytes or len(self.entries) > self.max_entries:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted[1])
+            self.evictions += 1
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _scan_disk(self):
+        """index the disk tier left by earlier runs, oldest first, and trim it to the limit"""
+        files = []
+        for prefix in os.scandir(self.disk_dir):
+            if not prefix.is_dir():
+                continue
+            for entry in os.scandir(prefix.path):
+                if entry.name.endswith('.json'):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, entry.name[:-len('.json')], stat.st_size))
+        files.sort()
+        with self.lock:
+            self.disk_entries = OrderedDict((key, size) for _, key, size in files)
+            self.disk_size = sum(self.disk_entries.values())
+        self._evict_disk()
+
+    def _evict_disk(self):
+        """delete least recently used files above the disk limit"""
+        evicted = []
+        with self.lock:
+            while self.disk_size > self.disk_max_bytes and self.disk_entries:
+                key, size = self.disk_entries.popitem(last=False)
+                self.disk_size -= size
+                self.disk_evictions += 1
+                evicted.append(key)
+        for key in evicted:
+            try:
+                os.unlink(self._disk_path(key))
+            except OSError:
+                pass
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                size = os.fstat(f.fileno()).st_size
+                data = json.load(f)
+            entry = (data['success'], data['output'])
+        except (OSError, ValueError, KeyError):
+            return None
+        # the modification time orders the disk tier after a restart
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self.lock:
+            # another process may have written it
+            self.disk_size += size - self.disk_entries.pop(key, 0)
+            self.disk_entries[key] = size
+        return entry
+
+    def _write_disk(self, key, entry):
+        if not self.disk_dir:
+            return
+        try:
+            path = self._disk_path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            partial_path = f"{path}.{threading.get_ident()}.partial"
+            with open(partial_path, 'w', encoding='utf-8') as f:
+                json.dump({'success': entry[0], 'output': entry[1]}, f)
+            size = os.path.getsize(partial_path)
+            os.replace(partial_path, path)
+        except OSError as e:
+            print(f'[Render Cache] Write Disk Cache Failed: {e}')
+            return
+        with self.lock:
+            self.disk_size += size - self.disk_entries.pop(key, 0)
+            self.disk_entries[key] = size
+        self._evict_disk()
+
+
+# shared cache instance
+render_cache = RenderCache()
@@ -1,7 +1,14 @@
 import os
-import shutil
-import tempfile
+import re
+import threading
 import subprocess
+from app.cache import render_cache
+from app.precheck import compile_precheck
+from app.svg import optimize_svg
+from app.metrics import COMPILE_RESULTS, SVG_BYTES
+from app.tracing import compile_tracer
+from app.backends import CompileCancelled, CliBackend, WatchBackend, EngineBackend
+from app.service import ServiceBackend
 
 # Prelude Code
 TYPST_PRELUDE = """
@@ -9,87 +16,293 @@ TYPST_PRELUDE = """
 #set text(size: 24pt)
 """
 
+# Environment Wrappers: (prefix, suffix) around the submitted code
+ENVIRONMENT_WRAPPERS = {
+    'passage': ('', ''),
+    'inline-formula': ('$', '$'),
+    'interline-formula': ('$ ', ' $'),
+}
+
+# snippet file named in batch diagnostics
+BATCH_SNIPPET_FILE = re.compile(r'snippet-(\d+)\.typ')
+
+# Prelude + Wrapper Templates, precomputed per environment
+ENVIRONMENT_TEMPLATES = {
+    env: (TYPST_PRELUDE + "\n" + prefix, suffix)
+    for env, (prefix, suffix) in ENVIRONMENT_WRAPPERS.items()
+}
+
+
+def build_source(typst_code, env=None):
+    """full Typst source of code in an environment, code without env is used as is"""
+    prefix, suffix = ENVIRONMENT_TEMPLATES.get(env or 'passage', ENVIRONMENT_TEMPLATES['passage'])
+    return prefix + typst_code.strip() + suffix
+
+
+def build_batch_files(snippets):
+    """
+    multi-page document of (typst_code, env) snippets, one page each
+
+    every snippet is its own included file, so its set rules, brackets and
+    errors stay inside its page, the prelude is shared by all pages
+    """
+    files = {}
+    includes = []
+    for index, (typst_code, env) in enumerate(snippets):
+        prefix, suffix = ENVIRONMENT_WRAPPERS.get(env or 'passage', ENVIRONMENT_WRAPPERS['passage'])
+        files[f'snippet-{index}.typ'] = prefix + typst_code.strip() + suffix
+        includes.append(f'#include "snippet-{index}.typ"')
+    files['batch.typ'] = TYPST_PRELUDE + "\n" + "\n#pagebreak()\n".join(includes) + "\n"
+    return files
+
+
+def create_backend(config, name=None):
+    """build the compile backend selected by TYPST_BACKEND"""
+    name = name or config.get('TYPST_BACKEND', 'cli')
+    typst_path = config.get('TYPST_COMPILER_PATH', 'typst')
+    timeout = config.get('TYPST_COMPILE_TIMEOUT', 5)
+
+    if name == 'watch':
+        return WatchBackend(
+            typst_path=typst_path,
+            timeout=timeout,
+            idle_timeout=config.get('TYPST_WORKER_IDLE_TIMEOUT', 300),
+            warmup_code=TYPST_PRELUDE
+        )
+    if name == 'service':
+        return ServiceBackend(
+            socket_path=config.get('COMPILE_SERVICE_SOCKET'),
+            timeout=timeout
+        )
+    if name == 'engine':
+        return EngineBackend(
+            timeout=timeout,
+            processes=config.get('TYPST_ENGINE_PROCESSES', 1),
+            warmup_code=TYPST_PRELUDE
+        )
+    return CliBackend(
+        typst_path=typst_path,
+        timeout=timeout,
+        io_mode=config.get('TYPST_COMPILE_IO', 'file')
+    )
+
+
 class TypstRealtimeCompiler:
     """Typst Realtime Compiler"""
-    def __init__(self, user_id=None, session_id=None):
+    def __init__(self, user_id=None, session_id=None, backend=None, backend_factory=None):
         self.user_id = user_id
         self.session_id = session_id
         self.compile_count = 0
-        self.temp_dir = tempfile.mkdtemp()
-        
+        # latest compile request, older results are not emitted
+        self.latest_seq = 0
+        # compile backend: cli, watch, engine or service, built on first use
+        # so a tab that never compiles takes no workspace
+        self._backend = backend
+        self.backend_factory = backend_factory or CliBackend
+        self.backend_lock = threading.Lock()
+        self.closed = False
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            with self.backend_lock:
+                # a compile still queued when the session closed
+                if self.closed:
+                    raise CompileCancelled()
+                if self._backend is None:
+                    self._backend = self.backend_factory()
+        return self._backend
+
     def __enter__(self):
         return self
-        
+
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.cleanup()
-    
-    def compile_to_svg(self, typst_code):
-        """Compile Typst Code to SVG"""
+
+    def compile_to_svg(self, typst_code, env=None, optimize=None, precision=2):
+        """Compile Typst Code to SVG, optimize='aggressive' also cuts numeric precision"""
         self.compile_count += 1
-        
+
         try:
-            # build temp file
-            input_file = os.path.join(self.temp_dir, "input.typ")
-            output_file = os.path.join(self.temp_dir, "output.svg")
-            full_code = TYPST_PRELUDE + "\n" + typst_code
-            
-            # write Typst Code 
-            with open(input_file, 'w', encoding='utf-8') as f:
-                f.write(full_code)
-            
-            # run typst compile
-            result = subprocess.run(
-                ['typst', 'compile', input_file, output_file, '--format', 'svg'],
-                capture_output=True,
-                text=True,
-                timeout=5
-            )
-            
-            # check result
-            if result.returncode == 0 and os.path.exists(output_file):
-                # read SVG file
-                with open(output_file, 'r', encoding='utf-8') as f:
-                    svg_content = f.read()
-                                    
-                return {
-                    'success': True,
-                    'svg': svg_content,
-                    'user_id': self.user_id,
-                    'session_id': self.session_id,
-                    'compile_count': self.compile_count
-                }
-            else:
-                error_msg = result.stderr or "Compile Failed"
+            full_code = build_source(typst_code, env)
+
+            # cannot compile yet, keep typst for plausible code
+            with compile_tracer.span('precheck'):
+                reason = compile_precheck.check(full_code)
+            if reason:
+                COMPILE_RESULTS.inc('incomplete')
                 return {
                     'success': False,
-                    'error': self._process_error_message(error_msg)
+                    'incomplete': True,
+                    'error': reason
                 }
-                
+            success, output = self.compile_source(full_code)
+            return self._compile_result(success, output, optimize, precision)
+
+        except CompileCancelled:
+            COMPILE_RESULTS.inc('cancelled')
+            return {
+                'success': False,
+                'cancelled': True,
+                'error': 'Compilation Cancelled'
+            }
         except subprocess.TimeoutExpired:
+            COMPILE_RESULTS.inc('timeout')
             return {
                 'success': False,
                 'error': 'Compilation Timeout!'
             }
         except FileNotFoundError:
+            COMPILE_RESULTS.inc('typst_missing')
             return {
                 'success': False,
                 'error': 'Typst do not in PATH!'
             }
         except Exception as e:
+            COMPILE_RESULTS.inc('internal_error')
             return {
                 'success': False,
                 'error': f'Compile Error: {str(e)}'
             }
-    
+
+    def compile_batch(self, snippets, optimize=None, precision=2):
+        """
+        Compile (typst_code, env) Snippets as Pages of one Document, return a result per snippet
+
+        one typst run covers the batch, a failed batch is bisected until the
+        failing snippets compile on their own
+        """
+        results = [None] * len(snippets)
+        batch = []
+        for index, (typst_code, env) in enumerate(snippets):
+            full_code = build_source(typst_code, env)
+            # shared cache, precheck failures and single snippets take the normal path
+            if self.backend.shared_cache or len(snippets) == 1 or compile_precheck.check(full_code):
+                results[index] = self.compile_to_svg(typst_code, env, optimize, precision)
+                continue
+            cached = render_cache.get(render_cache.make_key(full_code))
+            if cached is not None:
+                self.compile_count += 1
+                results[index] = self._compile_result(*cached, optimize, precision)
+            else:
+                batch.append((index, typst_code, env, full_code))
+
+        self._compile_pages(batch, results, optimize, precision)
+        return results
+
+    def _compile_pages(self, batch, results, optimize, precision):
+        """compile a batch as one document, bisect it on failure"""
+        if len(batch) <= 1:
+            for index, typst_code, env, _ in batch:
+                results[index] = self.compile_to_svg(typst_code, env, optimize, precision)
+            return
+
+        try:
+            success, pages = self.backend.compile_document(
+                build_batch_files([(typst_code, env) for _, typst_code, env, _ in batch]),
+                'batch.typ'
+            )
+        except NotImplementedError:
+            # backend without multi-page output: one compile per snippet
+            for index, typst_code, env, _ in batch:
+                results[index] = self.compile_to_svg(typst_code, env, optimize, precision)
+            return
+        except (subprocess.TimeoutExpired, CompileCancelled, OSError):
+            success, pages = False, None
+
+        # a snippet with its own page breaks shifts the pages, bisect it out too
+        if success and len(pages) == len(batch):
+            for (index, _, _, full_code), page in zip(batch, pages):
+                output = optimize_svg(page, 'lossless')
+                render_cache.put(render_cache.make_key(full_code), True, output)
+                self.compile_count += 1
+                results[index] = self._compile_result(True, output, optimize, precision)
+            return
+
+        # diagnostics name the failing snippets: compile those alone, batch the rest again
+        if not success and pages:
+            failing = {int(position) for position in BATCH_SNIPPET_FILE.findall(pages)}
+            if failing and failing.issubset(range(len(batch))):
+                for position in sorted(failing):
+                    index, typst_code, env, _ = batch[position]
+                    results[index] = self.compile_to_svg(typst_code, env, optimize, precision)
+                rest = [item for position, item in enumerate(batch) if position not in failing]
+                self._compile_pages(rest, results, optimize, precision)
+                return
+
+        middle = len(batch) // 2
+        self._compile_pages(batch[:middle], results, optimize, precision)
+        self._compile_pages(batch[middle:], results, optimize, precision)
+
+    def compile_source(self, full_code):
+        """Compile full Typst Source through the render cache, return (success, svg or error message)"""
+        # the compile service caches for all web workers
+        if self.backend.shared_cache:
+            return self.backend.compile(full_code)
+
+        # check render cache: same (env, code) gives the same source in editor and history
+        cache_key = render_cache.make_key(full_code)
+        cached = render_cache.get(cache_key)
+        compile_tracer.annotate(cache_hit=cached is not None)
+        if cached is not None:
+            return cached
+        success, output = self._compile(full_code)
+        render_cache.put(cache_key, success, output)
+        return success, output
+
+    def _compile(self, full_code):
+        """Compile full Typst Source, return (success, svg or error message)"""
+        success, output = self.backend.compile(full_code)
+        if success:
+            return True, optimize_svg(output, 'lossless')
+        return False, self._process_error_message(output)
+
+    def cancel(self):
+        """supersede the running compile"""
+        if self._backend is not None:
+            self._backend.cancel()
+
+    def _compile_result(self, success, output, optimize=None, precision=2):
+        """build the result of a finished compile"""
+        if success:
+            # cache holds lossless output, aggressive is per consumer
+            if optimize == 'aggressive':
+                with compile_tracer.span('optimize'):
+                    output = optimize_svg(output, 'aggressive', precision)
+            COMPILE_RESULTS.inc('success')
+            SVG_BYTES.observe(len(output))
+            return self._success_result(output)
+        COMPILE_RESULTS.inc('typst_error')
+        return {
+            'success': False,
+            'error': output
+        }
+
+    def _success_result(self, svg_content):
+        """build success result"""
+        return {
+            'success': True,
+            'svg': svg_content,
+            'user_id': self.user_id,
+            'session_id': self.session_id,
+            'compile_count': self.compile_count
+        }
+
     def _process_error_message(self, error_msg):
         """process error message"""
+        # drop the workspace path, cached errors are shared between sessions
+        if self.backend.temp_dir:
+            return error_msg.replace(self.backend.temp_dir + os.sep, '')
         return error_msg
-    
+
     def cleanup(self):
         """clean temp files"""
         try:
-            if os.path.exists(self.temp_dir):
-                shutil.rmtree(self.temp_dir)
+            with self.backend_lock:
+                self.closed = True
+                backend, self._backend = self._backend, None
+            if backend is not None:
+                backend.cleanup()
             print(f'[SocketIO] Clean up Compiler | User: "{self.user_id}" | Session: "{self.session_id}" | Active Connections: {self.compile_count}')
         except Exception as e:
-            print(f"Clean TEMP Files Failed: {e}")
\ No newline at end of file
+            print(f"Clean TEMP Files Failed: {e}")
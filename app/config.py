@@ -21,6 +21,107 @@ class Config:
     SOCKETIO_ASYNC_MODE = 'gevent'
     SOCKETIO_PING_TIMEOUT = 60
     SOCKETIO_PING_INTERVAL = 25
+    # multi-worker deployments (sticky sessions): emits across workers go through this queue,
+    # e.g. redis://localhost:6379/0, needs the redis extra: pip install ".[redis]" / uv sync --extra redis
+    # and gevent monkey patching, main.py applies it when this or SESSION_REGISTRY_URL is set
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+    # sessions and stats of all workers, in memory when unset, any Redis-protocol server otherwise
+    SESSION_REGISTRY_URL = os.environ.get('SESSION_REGISTRY_URL')
+    SESSION_REGISTRY_PREFIX = 'typstlive'
+    SESSION_REGISTRY_HEARTBEAT = 15
+    
+    # Metrics: Prometheus text at /metrics, scrapers send `Authorization: Bearer <token>` when a token is set
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() != 'false'
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    
+    # Tracing: span trees of sampled compile events, 0 and no TRACE_USERS disables it
+    TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', 0))
+    # user ids traced on every compile, comma separated
+    TRACE_USERS = [user_id for user_id in os.environ.get('TRACE_USERS', '').split(',') if user_id]
+    # 'jsonl' appends to TRACE_JSONL_PATH, 'otlp' posts OTLP/HTTP JSON to TRACE_OTLP_ENDPOINT
+    TRACE_EXPORT = os.environ.get('TRACE_EXPORT', 'jsonl')
+    TRACE_JSONL_PATH = os.environ.get('TRACE_JSONL_PATH', 'traces.jsonl')
+    TRACE_OTLP_ENDPOINT = os.environ.get('TRACE_OTLP_ENDPOINT', 'http://localhost:4318/v1/traces')
+    
+    # Typst
+    TYPST_COMPILER_PATH = os.environ.get('TYPST_COMPILER_PATH') or 'typst'
+    TYPST_COMPILE_TIMEOUT = 5
+    # compile backend:
+    #   'cli'    one `typst compile` process per compile
+    #   'watch'  one persistent `typst watch` child per session, kept warm between compiles
+    #   'engine' typst Python bindings in resident worker processes, needs the engine extra: pip install ".[engine]"
+    #   'service' the standalone compile service (compile_service.py) over a Unix socket
+    TYPST_BACKEND = os.environ.get('TYPST_BACKEND', 'watch')
+    TYPST_WORKER_IDLE_TIMEOUT = 300
+    TYPST_ENGINE_PROCESSES = int(os.environ.get('TYPST_ENGINE_PROCESSES', 0)) or os.cpu_count() or 1
+    # cli backend io: 'pipe' streams over stdin/stdout, 'file' uses a temp workspace
+    TYPST_COMPILE_IO = os.environ.get('TYPST_COMPILE_IO', 'pipe')
+    # temp workspaces (file io and persistent workers) live on tmpfs when available
+    TYPST_WORKSPACE_DIR = os.environ.get('TYPST_WORKSPACE_DIR') or ('/dev/shm' if os.path.isdir('/dev/shm') else None)
+    # workspaces are emptied and reused between compilers, at most this many are kept idle
+    TYPST_WORKSPACE_POOL_SIZE = int(os.environ.get('TYPST_WORKSPACE_POOL_SIZE', 64))
+    # created at startup when the backend uses workspaces (watch, or cli with file io)
+    TYPST_WORKSPACE_POOL_PREWARM = int(os.environ.get('TYPST_WORKSPACE_POOL_PREWARM', 8))
+    
+    # render cache: shared by all sessions, keyed by hash of prelude + code
+    RENDER_CACHE_MAX_BYTES = 64 * 1024 * 1024
+    RENDER_CACHE_MAX_ENTRIES = 4096
+    # optional disk tier, survives restarts, least recently used files go above the limit,
+    # keys include the typst and optimizer versions, RENDER_CACHE_SALT invalidates it by hand
+    RENDER_CACHE_DIR = os.environ.get('RENDER_CACHE_DIR')
+    RENDER_CACHE_DIR_MAX_BYTES = int(os.environ.get('RENDER_CACHE_DIR_MAX_BYTES', 1024 * 1024 * 1024))
+    RENDER_CACHE_SALT = os.environ.get('RENDER_CACHE_SALT')
+    
+    # rendered favorites: content-addressed SVGs, default is the instance folder
+    ARTIFACT_DIR = os.environ.get('ARTIFACT_DIR')
+    # Cache-Control max-age of served artifacts, they never change under their URL
+    ARTIFACT_MAX_AGE = 365 * 24 * 3600
+    # unrendered favorites are compiled as pages of one document, this many per typst run
+    HISTORY_BATCH_SIZE = 32
+    # favorites per page of /history and /api/history
+    HISTORY_PAGE_SIZE = 20
+    # favorites per /api/history/thumbnails response
+    HISTORY_THUMBNAIL_LIMIT = 50
+    
+    # compile scheduler: concurrent compiles and pending compiles per user
+    COMPILE_WORKERS = int(os.environ.get('COMPILE_WORKERS', 0)) or os.cpu_count() or 1
+    COMPILE_QUEUE_DEPTH = 8
+    # how compiles run next to the event loop: 'threadpool', 'cooperative' or 'inline'
+    # 'cooperative' needs gevent monkey patching, main.py applies it for this setting,
+    # a patched 'threadpool' (message queue, session registry) runs cooperative
+    COMPILE_EXECUTION = os.environ.get('COMPILE_EXECUTION', 'threadpool')
+    # debounce recommended to each client: documents compiling faster than FREE_MS stay instant,
+    # slower documents and a busy scheduler back off up to MAX_MS
+    ADAPTIVE_DEBOUNCE = True
+    ADAPTIVE_DEBOUNCE_FREE_MS = 50
+    ADAPTIVE_DEBOUNCE_MAX_MS = 1500
+    # the debounce floor of a throttled session halves every HALF_LIFE seconds
+    ADAPTIVE_DEBOUNCE_FLOOR_HALF_LIFE = 10
+    # compile rate limits: token buckets refilling RATE compiles per second up to BURST, 0 disables
+    # read on every compile event, so app.config changes apply live
+    COMPILE_RATE_PER_USER = 20
+    COMPILE_BURST_PER_USER = 40
+    COMPILE_RATE_PER_SESSION = 10
+    COMPILE_BURST_PER_SESSION = 20
+    # standalone compile service: one warm compiler pool and render cache for all web workers
+    COMPILE_SERVICE_SOCKET = os.environ.get('COMPILE_SERVICE_SOCKET') or '/tmp/typstlive-compile.sock'
+    COMPILE_SERVICE_WORKERS = int(os.environ.get('COMPILE_SERVICE_WORKERS', 0)) or os.cpu_count() or 1
+    # backend of the service's compilers: 'cli', 'watch' or 'engine' (engine extra)
+    COMPILE_SERVICE_BACKEND = os.environ.get('COMPILE_SERVICE_BACKEND', 'watch')
+    # skip typst for code that ends inside a formula, string, raw text or call
+    COMPILE_PRECHECK = True
+    
+    # svg patches: send a structural diff instead of the full SVG when it saves this fraction
+    SVG_PATCH_MIN_SAVING = 0.2
+    # SVG optimizer per consumer: 'aggressive' also cuts numbers to SVG_OPTIMIZE_PRECISION decimals
+    SVG_OPTIMIZE_EDITOR = os.environ.get('SVG_OPTIMIZE_EDITOR', 'aggressive')
+    SVG_OPTIMIZE_HISTORY = os.environ.get('SVG_OPTIMIZE_HISTORY', 'lossless')
+    SVG_OPTIMIZE_PRECISION = int(os.environ.get('SVG_OPTIMIZE_PRECISION', 2))
+    
+    # compressed results: svg / patch fields above this size go out as deflate binary attachments
+    # for clients that send encoding='deflate'
+    COMPILE_RESULT_COMPRESS_MIN_BYTES = 1024
+    COMPILE_RESULT_COMPRESS_LEVEL = 6
     
     
     """
@@ -33,7 +134,6 @@ class Config:
     ALLOWED_EXTENSIONS = {'png', 'svg', 'pdf'}
     
     # Typst
-    TYPST_COMPILER_PATH = os.environ.get('TYPST_COMPILER_PATH') or 'typst'
     TYPST_OUTPUT_FORMAT = 'png'
     
     # development
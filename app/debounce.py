@@ -0,0 +1,94 @@
+import time
+import threading
+from app.scheduler import compile_scheduler
+
+
+class DebounceAdvisor:
+    """Recommended Client Debounce per Session, from compile times and scheduler load"""
+    def __init__(self, free_ms=50, max_ms=1500, smoothing=0.3, floor_half_life=10.0, clock=time.monotonic):
+        self.enabled = True
+        self.free_ms = free_ms
+        self.max_ms = max_ms
+        self.smoothing = smoothing
+        # seconds for a throttle floor to halve once the session is no longer throttled
+        self.floor_half_life = floor_half_life
+        self.clock = clock
+        self.lock = threading.Lock()
+        # moving averages of compile time in ms: {session_id: ms}, all sessions
+        self.session_ms = {}
+        self.global_ms = 0.0
+        # {session_id: (ms, set at)}, lower bound after the rate limiter throttled the session
+        self.floors = {}
+        # {session_id: ms}, last value sent to the session
+        self.advertised = {}
+
+    def init_app(self, app):
+        """read debounce config"""
+        self.enabled = app.config.get('ADAPTIVE_DEBOUNCE', self.enabled)
+        self.free_ms = app.config.get('ADAPTIVE_DEBOUNCE_FREE_MS', self.free_ms)
+        self.max_ms = app.config.get('ADAPTIVE_DEBOUNCE_MAX_MS', self.max_ms)
+        self.floor_half_life = app.config.get('ADAPTIVE_DEBOUNCE_FLOOR_HALF_LIFE', self.floor_half_life)
+
+    def record(self, session_id, elapsed):
+        """a compile of the session took elapsed seconds"""
+        ms = elapsed * 1000
+        with self.lock:
+            previous = self.session_ms.get(session_id)
+            self.session_ms[session_id] = ms if previous is None else self._average(previous, ms)
+            self.global_ms = self._average(self.global_ms, ms) if self.global_ms else ms
+
+    def set_floor(self, session_id, ms):
+        """the session was throttled, keep its debounce at ms or more for a while"""
+        with self.lock:
+            self.floors[session_id] = (max(self._floor(session_id), ms), self.clock())
+
+    def _floor(self, session_id):
+        """throttle floor, halved every floor_half_life seconds since it was set"""
+        floor = self.floors.get(session_id)
+        if floor is None:
+            return 0
+        ms, set_at = floor
+        ms *= 0.5 ** ((self.clock() - set_at) / self.floor_half_life)
+        # below the 10 ms resolution of recommendations
+        if ms < 10:
+            del self.floors[session_id]
+            return 0
+        return ms
+
+    def recommend(self, session_id):
+        """debounce in ms, None when the client should keep its own"""
+        if not self.enabled:
+            return None
+        scheduler = compile_scheduler.stats()
+        with self.lock:
+            session_ms = self.session_ms.get(session_id, 0.0)
+            # fast documents stay instant, slower ones wait about one compile time
+            debounce = session_ms if session_ms > self.free_ms else 0.0
+            # busy scheduler: wait for the backlog ahead of this session
+            load = (scheduler['running'] + scheduler['queued']) / scheduler['workers']
+            if load > 1:
+                debounce += self.global_ms * (load - 1)
+            debounce = max(debounce, self._floor(session_id))
+        return int(min(debounce, self.max_ms) // 10 * 10)
+
+    def advise(self, session_id):
+        """recommended debounce, None when the session already has this value"""
+        debounce = self.recommend(session_id)
+        with self.lock:
+            if debounce is None or self.advertised.get(session_id) == debounce:
+                return None
+            self.advertised[session_id] = debounce
+            return debounce
+
+    def discard_session(self, session_id):
+        with self.lock:
+            self.session_ms.pop(session_id, None)
+            self.floors.pop(session_id, None)
+            self.advertised.pop(session_id, None)
+
+    def _average(self, previous, value):
+        return previous + self.smoothing * (value - previous)
+
+
+# shared debounce advisor instance
+debounce_advisor = DebounceAdvisor()
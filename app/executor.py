@@ -0,0 +1,78 @@
+import os
+
+# execution strategies
+#   'inline'      call the compile in the scheduler worker, right for OS thread workers
+#   'cooperative' gevent monkey patching makes subprocess pipes and waits yield to the hub
+#   'threadpool'  run the blocking compile on a real OS thread, the worker task yields until it returns
+STRATEGIES = ('inline', 'cooperative', 'threadpool')
+
+
+def monkey_patched(*modules):
+    """main.py patched these standard library modules for gevent"""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return all(monkey.is_module_patched(module) for module in modules)
+
+
+class CompileExecutor:
+    """Run blocking Compiles without stalling the SocketIO Event Loop"""
+    def __init__(self, strategy='threadpool', threads=None):
+        self.strategy = strategy
+        self.threads = threads or os.cpu_count() or 1
+        self.async_mode = 'threading'
+        self.pool = None
+
+    def init_app(self, app, socketio):
+        """pair the configured strategy with the SocketIO async mode"""
+        self.async_mode = socketio.server.eio.async_mode
+        self.threads = app.config.get('COMPILE_WORKERS') or self.threads
+        strategy = app.config.get('COMPILE_EXECUTION', self.strategy)
+        if strategy not in STRATEGIES:
+            print(f'[Executor] Unknown Compile Execution "{strategy}", using threadpool')
+            strategy = 'threadpool'
+
+        if strategy == 'cooperative':
+            if app.config.get('TYPST_BACKEND') == 'engine':
+                # multiprocessing pipes do not yield to the hub
+                print('[Executor] Engine Backend blocks on multiprocessing pipes, using threadpool')
+                strategy = 'threadpool'
+            elif self.async_mode != 'gevent' or not monkey_patched('subprocess', 'threading'):
+                print('[Executor] Cooperative Compiles need gevent with monkey patching, using threadpool')
+                strategy = 'threadpool'
+        elif strategy == 'threadpool' and self.async_mode == 'gevent' and monkey_patched('subprocess', 'threading'):
+            # patched for the message queue or the registry: compiles yield by themselves, and the
+            # backends' patched locks and conditions would be waited on from the hub's OS threads,
+            # the engine stays on the threadpool, its multiprocessing pipes do not yield
+            if app.config.get('TYPST_BACKEND') != 'engine':
+                print('[Executor] Standard Library is monkey patched, using cooperative')
+                strategy = 'cooperative'
+
+        # scheduler workers are OS threads already
+        if self.async_mode == 'threading':
+            strategy = 'inline'
+
+        self.strategy = strategy
+        print(f'[Executor] Compile Execution: {self.strategy} | Async Mode: {self.async_mode} | Threads: {self.threads}')
+
+    def run(self, func, *args, **kwargs):
+        """call func(*args, **kwargs), the calling task yields while it blocks"""
+        if self.strategy != 'threadpool':
+            return func(*args, **kwargs)
+        if self.async_mode == 'eventlet':
+            from eventlet import tpool
+            return tpool.execute(func, *args, **kwargs)
+        return self._gevent_pool().apply(func, args, kwargs)
+
+    def _gevent_pool(self):
+        """real OS threads of the gevent hub"""
+        if self.pool is None:
+            import gevent
+            self.pool = gevent.get_hub().threadpool
+            self.pool.maxsize = max(self.pool.maxsize, self.threads)
+        return self.pool
+
+
+# shared executor instance
+compile_executor = CompileExecutor()
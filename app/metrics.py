@@ -0,0 +1,178 @@
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# bytes
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _counter_name(name):
+    """counter samples end in _total"""
+    return name if name.endswith('_total') else f'{name}_total'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter, one series per label values"""
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = _counter_name(name)
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.series[label_values] = self.series.get(label_values, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            series = dict(self.series)
+        for values, value in sorted(series.items()):
+            yield f'{self.name}{_format_labels(self.labels, values)} {_format_value(value)}'
+
+
+class Gauge:
+    """Value read at scrape time, the callback returns a number or {label values: number}"""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, callback, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.labels = tuple(labels)
+
+    def samples(self):
+        value = self.callback()
+        series = value if isinstance(value, dict) else {(): value}
+        for values, number in sorted(series.items()):
+            yield f'{self.name}{_format_labels(self.labels, values)} {_format_value(number)}'
+
+
+class ObservedCounter(Gauge):
+    """Monotonic count kept by another component, read at scrape time like a Gauge"""
+    kind = 'counter'
+
+    def __init__(self, name, documentation, callback, labels=()):
+        super().__init__(_counter_name(name), documentation, callback, labels)
+
+
+class Histogram:
+    """Bucketed observations, one series per label values"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        # {label values: [count per bucket..., count above the last bucket, sum]}
+        self.series = {}
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        """observe the duration of a block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def samples(self):
+        with self.lock:
+            series = {values: list(counts) for values, counts in self.series.items()}
+        for values, counts in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float('inf')), counts):
+                cumulative += count
+                labels = _format_labels(self.labels, values, [('le', _format_value(bound))])
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            yield f'{self.name}_sum{_format_labels(self.labels, values)} {_format_value(counts[-1])}'
+            yield f'{self.name}_count{_format_labels(self.labels, values)} {cumulative}'
+
+
+class MetricsRegistry:
+    """Metrics in the Prometheus text format"""
+    def __init__(self):
+        self.metrics = {}
+
+    def counter(self, name, documentation, labels=(), callback=None):
+        """counter incremented here, or read from callback when given"""
+        if callback is not None:
+            return self._register(ObservedCounter(name, documentation, callback, labels))
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, callback, labels=()):
+        return self._register(Gauge(name, documentation, callback, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            try:
+                lines.extend(metric.samples())
+            except Exception as e:
+                print(f'[Metrics] Collect "{metric.name}" Failed: {e}')
+        return '\n'.join(lines) + '\n'
+
+    def _register(self, metric):
+        # re-registering (app reloads) keeps the first metric
+        return self.metrics.setdefault(metric.name, metric)
+
+
+# shared metrics registry
+metrics = MetricsRegistry()
+
+# compile pipeline
+COMPILE_SECONDS = metrics.histogram(
+    'typstlive_compile_seconds',
+    'End-to-end compile latency, from compile event to emitted result',
+    labels=('result',)
+)
+COMPILE_PHASE_SECONDS = metrics.histogram(
+    'typstlive_compile_phase_seconds',
+    'Compile latency by phase: queue, write, exec, read, emit',
+    labels=('phase',)
+)
+COMPILE_RESULTS = metrics.counter(
+    'typstlive_compile_results_total',
+    'Compile results by outcome: success, typst_error, timeout, cancelled, incomplete, typst_missing, internal_error',
+    labels=('outcome',)
+)
+SVG_BYTES = metrics.histogram(
+    'typstlive_svg_bytes',
+    'Size of compiled SVGs in bytes',
+    buckets=SIZE_BUCKETS
+)
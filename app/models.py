@@ -1,5 +1,8 @@
 import os
+import hashlib
+import unicodedata
 from flask_login import UserMixin
+from sqlalchemy import DDL, event
 from datetime import datetime, timezone, date
 from app import db, login_manager
 
@@ -49,19 +52,67 @@ class CompilationHistory(db.Model):
     
     # table name
     __tablename__ = "compilation_history"
+    # newest favorites of a user, keyset pages on (created_at, id)
+    # one favorite per content of a user, saving it again bumps created_at
+    __table_args__ = (
+        db.Index("ix_compilation_history_user_created", "user_id", "created_at", "id"),
+        db.Index("ux_compilation_history_user_content", "user_id", "content_hash", unique=True),
+    )
     
     # info in table
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     typst_code = db.Column(db.Text, nullable=False)
     current_environment = db.Column(db.String(32), nullable=False)
+    # format of the stored render, '' until it is rendered
     output_format = db.Column(db.String(8), default='')
+    # content hash of the render in the artifact store
+    artifact_hash = db.Column(db.String(64), nullable=True, index=True)
+    # hash of the normalized code and environment, see make_content_hash()
+    content_hash = db.Column(db.String(64), nullable=True)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True)
     
     def __repr__(self):
         # return super().__repr__()
         return f"<CompilationHistory {self.id} | Env: {self.current_environment}>"
 
+    @staticmethod
+    def make_content_hash(code, env):
+        """
+        hash of code and environment, the same for saves that differ only in
+        line endings, trailing spaces, surrounding blank lines or unicode form
+        """
+        code = unicodedata.normalize("NFC", code).replace("\r\n", "\n").replace("\r", "\n")
+        code = "\n".join(line.rstrip() for line in code.split("\n")).strip("\n")
+        return hashlib.sha256(f"{env}\0{code}".encode("utf-8")).hexdigest()
+
+
+# full-text search over typst_code: a FULLTEXT index on MySQL,
+# an external-content FTS5 table kept in sync by triggers on SQLite
+db.Index(
+    "ix_compilation_history_typst_code_fulltext",
+    CompilationHistory.typst_code,
+    mysql_prefix="FULLTEXT"
+).ddl_if(dialect="mysql")
+
+HISTORY_FTS5_DDL = (
+    """CREATE VIRTUAL TABLE IF NOT EXISTS compilation_history_fts USING fts5(
+        typst_code, content='compilation_history', content_rowid='id', prefix='2 3'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS compilation_history_fts_insert AFTER INSERT ON compilation_history BEGIN
+        INSERT INTO compilation_history_fts(rowid, typst_code) VALUES (new.id, new.typst_code);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS compilation_history_fts_delete AFTER DELETE ON compilation_history BEGIN
+        INSERT INTO compilation_history_fts(compilation_history_fts, rowid, typst_code) VALUES ('delete', old.id, old.typst_code);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS compilation_history_fts_update AFTER UPDATE OF typst_code ON compilation_history BEGIN
+        INSERT INTO compilation_history_fts(compilation_history_fts, rowid, typst_code) VALUES ('delete', old.id, old.typst_code);
+        INSERT INTO compilation_history_fts(rowid, typst_code) VALUES (new.id, new.typst_code);
+    END""",
+)
+for statement in HISTORY_FTS5_DDL:
+    event.listen(CompilationHistory.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+
 
 @login_manager.user_loader
 def load_user(user_id):
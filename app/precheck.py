@@ -0,0 +1,269 @@
+import re
+import threading
+
+# characters that open or close a structure, text between them is skipped
+SPECIAL_PATTERN = re.compile(r'[\\$#\[\](){}"`/;\n]')
+IDENT_PATTERN = re.compile(r'[A-Za-z_][\w-]*')
+# statements, they end at a line break or ';'
+LINE_KEYWORDS = {'let', 'set', 'show', 'import', 'include', 'return'}
+# control flow, ends after its body block unless 'else' follows
+FLOW_KEYWORDS = {'if', 'for', 'while'}
+ELSE_PATTERN = re.compile(r'[ \t]*else\b')
+# characters of an automatic link, as typst lexes them
+LINK_PATTERN = re.compile(r"[0-9A-Za-z!#$%&*+,\-./:;=?@_~'()\[\]]")
+
+# lexer modes
+MARKUP = 'markup'   # content block, brackets must close
+TEXT = 'text'       # bare bracket in markup, may stay open
+MATH = 'math'
+CODE = 'code'
+LINE = 'line'       # keyword expression, ends at line break
+FLOW = 'flow'       # control flow expression, ends after its body
+
+CLOSERS = {'(': ')', '[': ']', '{': '}'}
+
+
+class Unclosed(Exception):
+    """source ends inside a structure"""
+
+
+def _string_end(source, start):
+    """index after the string starting at start, which is after the opening quote"""
+    i = start
+    while True:
+        i = source.find('"', i)
+        if i < 0:
+            raise Unclosed('Unclosed String')
+        # count escapes before the quote
+        backslashes = 0
+        while i - 1 - backslashes >= start and source[i - 1 - backslashes] == '\\':
+            backslashes += 1
+        if backslashes % 2 == 0:
+            return i + 1
+        i += 1
+
+
+def _raw_end(source, start):
+    """index after the raw text starting at start"""
+    length = 1
+    while source[start + length:start + length + 1] == '`':
+        length += 1
+    # `` is empty raw text
+    if length == 2:
+        return start + 2
+    end = source.find('`' * length, start + length)
+    if end < 0:
+        raise Unclosed('Unclosed Raw Text')
+    return end + length
+
+
+def _block_comment_end(source, start):
+    """index after the (nested) block comment, an open comment runs to the end"""
+    depth, i = 0, start
+    while i < len(source):
+        if source.startswith('/*', i):
+            depth += 1
+            i += 2
+        elif source.startswith('*/', i):
+            depth -= 1
+            i += 2
+            if depth == 0:
+                return i
+        else:
+            i += 1
+    return len(source)
+
+
+def _link_end(source, start):
+    """index after the automatic link whose '//' starts at start, unbalanced brackets end it"""
+    brackets = []
+    i = start
+    while i < len(source) and LINK_PATTERN.match(source, i):
+        char = source[i]
+        if char in '([':
+            brackets.append(char)
+        elif char in ')]':
+            if not brackets or CLOSERS[brackets.pop()] != char:
+                break
+        i += 1
+    return i
+
+
+def _enclosing_closer(stack):
+    """closer of the structure around the innermost keyword expression"""
+    for mode, closer, _ in reversed(stack):
+        if mode not in (LINE, FLOW):
+            return closer
+    return None
+
+
+def _call_tail(source, i, stack):
+    """after an embedded expression: field access, call arguments or trailing content"""
+    while True:
+        char = source[i:i + 1]
+        if char == '(':
+            stack.append((CODE, ')', True))
+            return i + 1
+        if char == '[':
+            stack.append((MARKUP, ']', True))
+            return i + 1
+        match = IDENT_PATTERN.match(source, i + 1) if char == '.' else None
+        if not match:
+            return i
+        i = match.end()
+
+
+def _embedded(source, i, stack):
+    """embedded code after '#' at i"""
+    char = source[i:i + 1]
+    if char in ('(', '{'):
+        stack.append((CODE, CLOSERS[char], True))
+        return i + 1
+    if char == '[':
+        stack.append((MARKUP, ']', True))
+        return i + 1
+    if char == '"':
+        return _call_tail(source, _string_end(source, i + 1), stack)
+    match = IDENT_PATTERN.match(source, i)
+    if not match:
+        return i
+    keyword = match.group(0)
+    if keyword in LINE_KEYWORDS:
+        stack.append((LINE, '\n', False))
+        return match.end()
+    if keyword in FLOW_KEYWORDS:
+        stack.append((FLOW, '\n', False))
+        return match.end()
+    if keyword == 'context':
+        # context takes one embedded expression
+        end = match.end()
+        while source[end:end + 1] in (' ', '\t'):
+            end += 1
+        return _embedded(source, end, stack) if end > match.end() else end
+    return _call_tail(source, match.end(), stack)
+
+
+def find_incomplete(source):
+    """
+    Spot Typst source that ends inside a structure: formula, raw text, string, call or block
+    return the reason, or None when the source could compile
+    only certain cases are reported, anything unclear goes to typst
+    """
+    stack = [(MARKUP, None, False)]
+    i = 0
+    try:
+        while True:
+            match = SPECIAL_PATTERN.search(source, i)
+            if not match:
+                break
+            i = match.start()
+            char = source[i]
+            next_char = source[i + 1:i + 2]
+            mode, closer, embedded = stack[-1]
+            markup = mode in (MARKUP, TEXT)
+            keyword = mode in (LINE, FLOW)
+            code = mode == CODE or keyword
+
+            # escapes, comments, line breaks
+            if char == '\\':
+                i += 1 if code else 2
+            elif char == '/':
+                if markup and next_char == '/' and source.endswith(('http:', 'https:'), 0, i):
+                    i = _link_end(source, i)
+                elif next_char == '/' and not (markup and source[i - 1:i] == ':'):
+                    end = source.find('\n', i)
+                    i = len(source) if end < 0 else end
+                elif next_char == '*':
+                    i = _block_comment_end(source, i)
+                else:
+                    i += 1
+            elif char in '\n;':
+                if keyword:
+                    stack.pop()
+                i += 1
+
+            # the structure around a keyword expression closes it too
+            elif keyword and char in ')]}$' and char == _enclosing_closer(stack):
+                stack.pop()
+
+            # strings and raw text
+            elif char == '"':
+                i = i + 1 if markup else _string_end(source, i + 1)
+            elif char == '`':
+                i = i + 1 if mode == MATH else _raw_end(source, i)
+
+            # formulas and embedded code
+            elif char == '$':
+                if mode == MATH:
+                    stack.pop()
+                else:
+                    stack.append((MATH, '$', False))
+                i += 1
+            elif char == '#':
+                i = _embedded(source, i + 1, stack) if not code else i + 1
+
+            # delimiters, brackets in math are text
+            elif char in CLOSERS:
+                if code:
+                    stack.append((MARKUP if char == '[' else CODE, CLOSERS[char], False))
+                elif markup and char == '[':
+                    stack.append((TEXT, ']', False))
+                i += 1
+            else:
+                if mode == MATH or (markup and char != ']'):
+                    i += 1
+                    continue
+                if char != closer:
+                    # stray closer, typst explains it better
+                    return None
+                stack.pop()
+                i = _call_tail(source, i + 1, stack) if embedded else i + 1
+                # control flow ends after its body, or goes on with 'else'
+                if char in ']}' and stack[-1][0] == FLOW and not ELSE_PATTERN.match(source, i):
+                    stack.pop()
+    except Unclosed as e:
+        return str(e)
+
+    for mode, closer, _ in reversed(stack):
+        if mode == MATH:
+            return 'Unclosed Formula: missing $'
+        if mode in (MARKUP, CODE) and closer:
+            return f'Unclosed Delimiter: missing {closer}'
+    return None
+
+
+class CompilePrecheck:
+    """Skip compiles of Typst Code that cannot compile yet"""
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        # counters
+        self.checked = 0
+        self.skipped = 0
+
+    def init_app(self, app):
+        """read precheck config"""
+        self.enabled = app.config.get('COMPILE_PRECHECK', self.enabled)
+
+    def check(self, full_code):
+        """return why full_code is incomplete, or None"""
+        if not self.enabled:
+            return None
+        reason = find_incomplete(full_code)
+        with self.lock:
+            self.checked += 1
+            if reason:
+                self.skipped += 1
+        return reason
+
+    def stats(self):
+        with self.lock:
+            return {
+                'checked': self.checked,
+                'skipped': self.skipped,
+                'skip_ratio': round(self.skipped / self.checked, 4) if self.checked else 0.0
+            }
+
+
+# shared precheck instance
+compile_precheck = CompilePrecheck()
@@ -0,0 +1,116 @@
+import time
+import threading
+
+
+class TokenBucket:
+    """Refills rate tokens per second up to burst"""
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self, rate, burst):
+        """add tokens since the last refill, limits may have changed meanwhile"""
+        now = time.monotonic()
+        self.rate, self.burst = rate, burst
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+
+    def wait_time(self):
+        """seconds until one token is available"""
+        if self.tokens >= 1:
+            return 0.0
+        if self.rate <= 0:
+            return float('inf')
+        return (1 - self.tokens) / self.rate
+
+
+class CompileRateLimiter:
+    """Token Buckets per User and per Session for compile events"""
+    def __init__(self):
+        self.config = {}
+        self.lock = threading.Lock()
+        # {user_id: bucket}, {session_id: bucket}
+        self.user_buckets = {}
+        self.session_buckets = {}
+        # counters
+        self.allowed = 0
+        self.throttled = 0
+        self.merged = 0
+
+    def init_app(self, app):
+        """limits are read from app.config on every check, so they can be tuned live"""
+        self.config = app.config
+
+    def limits(self):
+        """(user rate, user burst, session rate, session burst), a rate of 0 disables that bucket"""
+        return (
+            self.config.get('COMPILE_RATE_PER_USER', 0),
+            self.config.get('COMPILE_BURST_PER_USER', 1),
+            self.config.get('COMPILE_RATE_PER_SESSION', 0),
+            self.config.get('COMPILE_BURST_PER_SESSION', 1)
+        )
+
+    def acquire(self, user_id, session_id):
+        """take a token from both buckets, or return the seconds to wait"""
+        user_rate, user_burst, session_rate, session_burst = self.limits()
+        with self.lock:
+            buckets = []
+            if user_rate:
+                buckets.append(self._bucket(self.user_buckets, user_id, user_rate, user_burst))
+            if session_rate:
+                buckets.append(self._bucket(self.session_buckets, session_id, session_rate, session_burst))
+
+            wait = max((bucket.wait_time() for bucket in buckets), default=0.0)
+            if wait > 0:
+                return wait
+            for bucket in buckets:
+                bucket.tokens -= 1
+            self.allowed += 1
+            return 0.0
+
+    def count_held(self, merged=False):
+        """a throttled request was held back, or merged into one already held"""
+        with self.lock:
+            if merged:
+                self.merged += 1
+            else:
+                self.throttled += 1
+
+    def suggested_debounce(self):
+        """client debounce in ms that stays within the sustained rates"""
+        user_rate, _, session_rate, _ = self.limits()
+        rates = [rate for rate in (user_rate, session_rate) if rate]
+        return int(1000 / min(rates)) if rates else 0
+
+    def discard_session(self, session_id):
+        with self.lock:
+            self.session_buckets.pop(session_id, None)
+
+    def discard_user(self, user_id):
+        with self.lock:
+            self.user_buckets.pop(user_id, None)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'allowed': self.allowed,
+                'throttled': self.throttled,
+                'merged': self.merged,
+                'users': len(self.user_buckets),
+                'sessions': len(self.session_buckets)
+            }
+
+    @staticmethod
+    def _bucket(buckets, key, rate, burst):
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(rate, burst)
+        else:
+            bucket.refill(rate, burst)
+        return bucket
+
+
+# shared rate limiter instance
+compile_rate_limiter = CompileRateLimiter()
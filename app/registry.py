@@ -0,0 +1,304 @@
+import os
+import json
+import time
+import socket
+import threading
+from urllib.parse import urlparse
+from app.executor import monkey_patched
+
+
+class RegistryError(Exception):
+    """Error reply of the registry server"""
+
+
+class RespClient:
+    """Minimal client of the Redis protocol (RESP2), enough for the session registry"""
+    def __init__(self, url, timeout=2):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.sock = None
+        self.reader = None
+
+    def execute(self, *args):
+        """run one command, return its reply"""
+        return self.pipeline([args])[0]
+
+    def pipeline(self, commands):
+        """send commands in one round trip, return their replies"""
+        with self.lock:
+            try:
+                return self._pipeline(commands)
+            except OSError:
+                # stale connection: reconnect once
+                self.close()
+                return self._pipeline(commands)
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = self.reader = None
+
+    def _pipeline(self, commands):
+        if self.sock is None:
+            self._connect()
+        self.sock.sendall(b''.join(self._encode(args) for args in commands))
+        replies = [self._read() for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RegistryError):
+                raise reply
+        return replies
+
+    def _connect(self):
+        self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self.reader = self.sock.makefile('rb')
+        setup = []
+        if self.password:
+            setup.append(('AUTH', self.password))
+        if self.db:
+            setup.append(('SELECT', self.db))
+        if setup:
+            self._pipeline(setup)
+
+    @staticmethod
+    def _encode(args):
+        parts = [f'*{len(args)}\r\n'.encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode('utf-8')
+            parts.append(f'${len(data)}\r\n'.encode() + data + b'\r\n')
+        return b''.join(parts)
+
+    def _read(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError('Registry Connection Closed')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode('utf-8')
+        if kind == b'-':
+            return RegistryError(rest.decode('utf-8'))
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            return self.reader.read(length + 2)[:-2].decode('utf-8')
+        if kind == b'*':
+            length = int(rest)
+            return None if length < 0 else [self._read() for _ in range(length)]
+        raise ConnectionError(f'Unknown Registry Reply: {line!r}')
+
+
+class MemoryRegistryStore:
+    """Sessions of this Worker only"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        # {user_id: set(session_id_1, session_id_2, ...)}
+        self.user_sessions = {}
+        self.worker_stats = {}
+
+    def add(self, user_id, session_id):
+        with self.lock:
+            sessions = self.user_sessions.setdefault(str(user_id), set())
+            sessions.add(session_id)
+            return len(sessions)
+
+    def remove(self, user_id, session_id):
+        with self.lock:
+            sessions = self.user_sessions.get(str(user_id))
+            if sessions is None:
+                return 0
+            sessions.discard(session_id)
+            if not sessions:
+                del self.user_sessions[str(user_id)]
+            return len(sessions)
+
+    def user_connections(self, user_id):
+        with self.lock:
+            return len(self.user_sessions.get(str(user_id), ()))
+
+    def total_users(self):
+        with self.lock:
+            return len(self.user_sessions)
+
+    def heartbeat(self, stats):
+        self.worker_stats = stats
+
+    def worker_stats_list(self):
+        return [self.worker_stats]
+
+
+class RedisRegistryStore:
+    """
+    Sessions of all Workers in a Redis-protocol Server
+
+    {prefix}:users              set of user ids with sessions
+    {prefix}:user:{user_id}     hash session id -> worker id
+    {prefix}:worker:{worker_id} set of [user id, session id] of one worker
+    {prefix}:workers            hash worker id -> {'ts', 'stats'}, workers missing heartbeats are reaped
+    """
+    def __init__(self, url, prefix='typstlive', worker_ttl=60):
+        self.client = RespClient(url)
+        self.prefix = prefix
+        self.worker_ttl = worker_ttl
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}'
+
+    def _user_key(self, user_id):
+        return f'{self.prefix}:user:{user_id}'
+
+    def _worker_key(self, worker_id):
+        return f'{self.prefix}:worker:{worker_id}'
+
+    def add(self, user_id, session_id):
+        replies = self.client.pipeline([
+            ('HSET', self._user_key(user_id), session_id, self.worker_id),
+            ('SADD', f'{self.prefix}:users', user_id),
+            ('SADD', self._worker_key(self.worker_id), json.dumps([str(user_id), session_id])),
+            ('HLEN', self._user_key(user_id))
+        ])
+        return replies[-1]
+
+    def remove(self, user_id, session_id):
+        remaining = self.client.pipeline([
+            ('HDEL', self._user_key(user_id), session_id),
+            ('SREM', self._worker_key(self.worker_id), json.dumps([str(user_id), session_id])),
+            ('HLEN', self._user_key(user_id))
+        ])[-1]
+        if remaining == 0:
+            self._drop_user_if_empty(user_id)
+        return remaining
+
+    def _drop_user_if_empty(self, user_id):
+        self.client.execute('SREM', f'{self.prefix}:users', user_id)
+        # another worker added a session meanwhile
+        if self.client.execute('HLEN', self._user_key(user_id)):
+            self.client.execute('SADD', f'{self.prefix}:users', user_id)
+
+    def user_connections(self, user_id):
+        return self.client.execute('HLEN', self._user_key(user_id))
+
+    def total_users(self):
+        return self.client.execute('SCARD', f'{self.prefix}:users')
+
+    def heartbeat(self, stats):
+        self.client.execute('HSET', f'{self.prefix}:workers', self.worker_id, json.dumps({
+            'ts': time.time(),
+            'stats': stats
+        }))
+
+    def worker_stats_list(self):
+        """stats of live workers, sessions of dead workers are dropped"""
+        workers = self.client.execute('HGETALL', f'{self.prefix}:workers') or []
+        live = []
+        for worker_id, value in zip(workers[::2], workers[1::2]):
+            entry = json.loads(value)
+            if time.time() - entry['ts'] > self.worker_ttl and worker_id != self.worker_id:
+                self._reap(worker_id)
+            else:
+                live.append(entry['stats'])
+        return live
+
+    def _reap(self, worker_id):
+        """drop the sessions of a worker that stopped sending heartbeats"""
+        print(f'[Registry] Reap Worker "{worker_id}"')
+        members = self.client.execute('SMEMBERS', self._worker_key(worker_id)) or []
+        for member in members:
+            user_id, session_id = json.loads(member)
+            if self.client.pipeline([
+                ('HDEL', self._user_key(user_id), session_id),
+                ('HLEN', self._user_key(user_id))
+            ])[-1] == 0:
+                self._drop_user_if_empty(user_id)
+        self.client.pipeline([
+            ('DEL', self._worker_key(worker_id)),
+            ('HDEL', f'{self.prefix}:workers', worker_id)
+        ])
+
+
+class SessionRegistry:
+    """Cluster-wide Session Registry, in memory or in a Redis-protocol Server"""
+    def __init__(self, heartbeat_interval=15):
+        self.store = MemoryRegistryStore()
+        self.heartbeat_interval = heartbeat_interval
+        self.socketio = None
+        self.started = False
+        # returns numeric stats of this worker, summed across workers
+        self.stats_provider = None
+
+    def init_app(self, app, socketio):
+        """read registry config"""
+        self.socketio = socketio
+        url = app.config.get('SESSION_REGISTRY_URL')
+        self.heartbeat_interval = app.config.get('SESSION_REGISTRY_HEARTBEAT', self.heartbeat_interval)
+        if url:
+            # plain blocking sockets on the gevent hub would stall every client while the registry is slow
+            if socketio.server.eio.async_mode == 'gevent' and not monkey_patched('socket'):
+                raise RuntimeError('SESSION_REGISTRY_URL needs gevent monkey patching, main.py applies it for this setting')
+            self.store = RedisRegistryStore(
+                url,
+                prefix=app.config.get('SESSION_REGISTRY_PREFIX', 'typstlive'),
+                worker_ttl=self.heartbeat_interval * 4
+            )
+        else:
+            self.store = MemoryRegistryStore()
+
+    def add(self, user_id, session_id):
+        """register a session, return the user's active connections"""
+        self._start()
+        return self._call(1, self.store.add, user_id, session_id)
+
+    def remove(self, user_id, session_id):
+        """unregister a session, return the user's remaining connections"""
+        return self._call(0, self.store.remove, user_id, session_id)
+
+    def user_connections(self, user_id):
+        return self._call(0, self.store.user_connections, user_id)
+
+    def total_users(self):
+        return self._call(0, self.store.total_users)
+
+    def cluster_stats(self):
+        """worker stats summed across live workers"""
+        self._heartbeat()
+        workers = self._call([], self.store.worker_stats_list)
+        totals = {'workers': len(workers)}
+        for stats in workers:
+            for key, value in stats.items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def _call(self, default, func, *args):
+        """registry outages do not break the editor"""
+        try:
+            return func(*args)
+        except (OSError, RegistryError) as e:
+            print(f'[Registry] Registry Error: {e}')
+            return default
+
+    def _heartbeat(self):
+        stats = self.stats_provider() if self.stats_provider else {}
+        self._call(None, self.store.heartbeat, stats)
+
+    def _start(self):
+        """publish heartbeats on first use, in the SocketIO async mode"""
+        if self.started or self.socketio is None or isinstance(self.store, MemoryRegistryStore):
+            return
+        self.started = True
+        self.socketio.start_background_task(self._heartbeat_loop)
+
+    def _heartbeat_loop(self):
+        while True:
+            self._heartbeat()
+            self.socketio.sleep(self.heartbeat_interval)
+
+
+# shared registry instance
+session_registry = SessionRegistry()
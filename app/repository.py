@@ -0,0 +1,274 @@
+import re
+import base64
+import binascii
+from datetime import datetime, timezone
+from markupsafe import escape
+from sqlalchemy.exc import IntegrityError, OperationalError
+from app import db
+from app.models import CompilationHistory
+
+# search terms: words of the query, matched as prefixes
+SEARCH_TERM = re.compile(r'\w+')
+
+
+class InvalidCursor(ValueError):
+    """A page cursor that was not issued by this repository"""
+
+
+def highlight(text, terms, context=40, max_fragments=3):
+    """HTML-escaped fragments of text around the terms, matches wrapped in <mark>"""
+    pattern = re.compile('|'.join(re.escape(term) for term in sorted(terms, key=len, reverse=True)), re.IGNORECASE)
+    matches = list(pattern.finditer(text))
+    if not matches:
+        return [str(escape(text[:context * 2]))]
+
+    # windows around matches, overlapping ones merged
+    windows = []
+    for match in matches:
+        start, end = max(0, match.start() - context), min(len(text), match.end() + context)
+        if windows and start <= windows[-1][1]:
+            windows[-1][1] = end
+            windows[-1][2].append(match)
+        else:
+            windows.append([start, end, [match]])
+
+    fragments = []
+    for start, end, window_matches in windows[:max_fragments]:
+        parts = ['…' if start else '']
+        position = start
+        for match in window_matches:
+            parts.append(str(escape(text[position:match.start()])))
+            parts.append(f'<mark>{escape(match.group())}</mark>')
+            position = match.end()
+        parts.append(str(escape(text[position:end])))
+        parts.append('…' if end < len(text) else '')
+        fragments.append(''.join(parts))
+    return fragments
+
+
+def like_pattern(term):
+    """LIKE pattern matching term anywhere, wildcards in term are literal"""
+    return '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+class LikeSearch:
+    """Substring Search, newest first, for any database and for queries without words"""
+    def search(self, user_id, terms, limit, offset):
+        model = CompilationHistory
+        query = model.query.filter(model.user_id == user_id)
+        for term in terms:
+            query = query.filter(model.typst_code.ilike(like_pattern(term), escape='\\'))
+        items = query.order_by(model.created_at.desc(), model.id.desc()).offset(offset).limit(limit).all()
+        return [(item, None) for item in items]
+
+
+class MysqlFulltextSearch:
+    """MySQL FULLTEXT Search in boolean mode, words below the InnoDB token size go to LIKE"""
+    def __init__(self, min_token_size=3):
+        self.min_token_size = min_token_size
+        self.fallback = LikeSearch()
+
+    def search(self, user_id, terms, limit, offset):
+        words = [term for term in terms if len(term) >= self.min_token_size]
+        if not words:
+            return self.fallback.search(user_id, terms, limit, offset)
+
+        params = {
+            'against': ' '.join(f'+{word}*' for word in words),
+            'user_id': user_id,
+            'limit': limit,
+            'offset': offset
+        }
+        short_filters = ''
+        for position, term in enumerate(term for term in terms if len(term) < self.min_token_size):
+            short_filters += f' AND typst_code LIKE :short_{position}'
+            params[f'short_{position}'] = like_pattern(term)
+        rows = db.session.execute(db.text(f"""
+            SELECT id, MATCH (typst_code) AGAINST (:against IN BOOLEAN MODE) AS score
+            FROM compilation_history
+            WHERE user_id = :user_id AND MATCH (typst_code) AGAINST (:against IN BOOLEAN MODE){short_filters}
+            ORDER BY score DESC, id DESC
+            LIMIT :limit OFFSET :offset
+        """), params).all()
+        return _load_ranked(rows)
+
+
+class SqliteFts5Search:
+    """SQLite FTS5 Search ranked by bm25"""
+    def __init__(self):
+        self.fallback = LikeSearch()
+
+    def search(self, user_id, terms, limit, offset):
+        match = ' '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+        try:
+            rows = db.session.execute(db.text("""
+                SELECT h.id AS id, -bm25(compilation_history_fts) AS score
+                FROM compilation_history_fts JOIN compilation_history h ON h.id = compilation_history_fts.rowid
+                WHERE compilation_history_fts MATCH :match AND h.user_id = :user_id
+                ORDER BY bm25(compilation_history_fts), h.id DESC
+                LIMIT :limit OFFSET :offset
+            """), {'match': match, 'user_id': user_id, 'limit': limit, 'offset': offset}).all()
+        except OperationalError as e:
+            # database created before the search migration
+            db.session.rollback()
+            print(f'[History Search] FTS5 Search Failed, Use LIKE: {e}')
+            return self.fallback.search(user_id, terms, limit, offset)
+        return _load_ranked(rows)
+
+
+def _load_ranked(rows):
+    """[(item, score)] in the order of (id, score) rows"""
+    items = {item.id: item for item in CompilationHistory.query.filter(CompilationHistory.id.in_([row.id for row in rows]))}
+    return [(items[row.id], float(row.score)) for row in rows if row.id in items]
+
+
+class HistoryRepository:
+    """Queries over the Compilation History (Favorites) of a User"""
+    def __init__(self, model=CompilationHistory):
+        self.model = model
+        # {dialect name: search backend}
+        self.search_backends = {
+            'mysql': MysqlFulltextSearch(),
+            'sqlite': SqliteFts5Search()
+        }
+        self.like_search = LikeSearch()
+
+    def save(self, user_id, code, env):
+        """
+        favorite code of the user, an upsert on (user_id, content_hash)
+
+        return (item, created), saving the same content again only bumps its
+        created_at so it comes first, the caller commits
+        """
+        model = self.model
+        content_hash = model.make_content_hash(code, env)
+        item = model.query.filter_by(user_id=user_id, content_hash=content_hash).first()
+        if item is None:
+            item = model(user_id=user_id, typst_code=code, current_environment=env, content_hash=content_hash)
+            try:
+                with db.session.begin_nested():
+                    db.session.add(item)
+                return item, True
+            except IntegrityError:
+                # saved by a concurrent request in between
+                item = model.query.filter_by(user_id=user_id, content_hash=content_hash).one()
+        item.created_at = datetime.now(timezone.utc)
+        return item, False
+
+    def deduplicate(self, batch_size=1000):
+        """
+        backfill content_hash and merge favorites with the same content
+
+        the last saved row of each content is kept, return (rows hashed,
+        removed rows), removed rows are (id, artifact_hash, output_format)
+        """
+        model = self.model
+        # {(user_id, content_hash): [(created_at, id, artifact_hash, output_format)]}
+        groups = {}
+        missing = {}
+        last_id = 0
+        while True:
+            rows = db.session.execute(
+                db.select(model.id, model.user_id, model.typst_code, model.current_environment,
+                          model.content_hash, model.created_at, model.artifact_hash, model.output_format)
+                .where(model.id > last_id).order_by(model.id).limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            for row in rows:
+                content_hash = model.make_content_hash(row.typst_code, row.current_environment)
+                if row.content_hash != content_hash:
+                    missing[row.id] = content_hash
+                groups.setdefault((row.user_id, content_hash), []).append(
+                    (row.created_at, row.id, row.artifact_hash, row.output_format))
+
+        keep_artifacts = []
+        removed = []
+        for saves in groups.values():
+            if len(saves) < 2:
+                continue
+            saves.sort(reverse=True)
+            kept = saves[0]
+            removed.extend((item_id, artifact_hash, output_format) for _, item_id, artifact_hash, output_format in saves[1:])
+            # the kept row takes over a render of a removed one
+            if not kept[2]:
+                rendered = next((save for save in saves[1:] if save[2]), None)
+                if rendered:
+                    keep_artifacts.append({'id': kept[1], 'artifact_hash': rendered[2], 'output_format': rendered[3]})
+
+        # duplicates go first, the unique index holds at every step
+        removed_ids = [item_id for item_id, _, _ in removed]
+        for start in range(0, len(removed_ids), batch_size):
+            db.session.execute(db.delete(model).where(model.id.in_(removed_ids[start:start + batch_size])))
+        removed_ids = set(removed_ids)
+        updates = [{'id': item_id, 'content_hash': content_hash}
+                   for item_id, content_hash in missing.items() if item_id not in removed_ids]
+        for start in range(0, len(updates), batch_size):
+            db.session.execute(db.update(model), updates[start:start + batch_size])
+        if keep_artifacts:
+            db.session.execute(db.update(model), keep_artifacts)
+        db.session.commit()
+        return len(updates), removed
+
+    def search(self, user_id, query, page=1, limit=20):
+        """
+        favorites of the user matching every word of query, best first
+
+        return ([{item, score, fragments}], has more pages), queries without
+        words (only symbols) are matched as substrings
+        """
+        query = query.strip()
+        terms = SEARCH_TERM.findall(query)
+        if terms:
+            backend = self.search_backends.get(db.engine.dialect.name, self.like_search)
+        else:
+            backend, terms = self.like_search, [query]
+
+        ranked = backend.search(user_id, terms, limit + 1, (page - 1) * limit)
+        hits = [{
+            'item': item,
+            'score': score,
+            'fragments': highlight(item.typst_code, terms)
+        } for item, score in ranked[:limit]]
+        return hits, len(ranked) > limit
+
+    def page(self, user_id, cursor=None, limit=20):
+        """
+        newest favorites first, keyset-paginated on (created_at, id)
+
+        return (items, next cursor or None), reads stay on the
+        (user_id, created_at, id) index however deep the page is
+        """
+        model = self.model
+        query = model.query.filter(model.user_id == user_id)
+        if cursor:
+            created_at, item_id = self.decode_cursor(cursor)
+            query = query.filter(db.or_(
+                model.created_at < created_at,
+                db.and_(model.created_at == created_at, model.id < item_id)
+            ))
+        items = query.order_by(model.created_at.desc(), model.id.desc()).limit(limit + 1).all()
+        if len(items) <= limit:
+            return items, None
+        items = items[:limit]
+        return items, self.encode_cursor(items[-1])
+
+    @staticmethod
+    def encode_cursor(item):
+        raw = f"{item.created_at.isoformat()}|{item.id}".encode('utf-8')
+        return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """(created_at, id) of the last item of the previous page"""
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+            created_at, item_id = raw.rsplit('|', 1)
+            return datetime.fromisoformat(created_at), int(item_id)
+        except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+            raise InvalidCursor(f'Invalid Cursor: {cursor}') from e
+
+
+# shared history repository instance
+history_repository = HistoryRepository()
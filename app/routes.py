@@ -1,17 +1,39 @@
 import os
 import tempfile
 import subprocess
+import threading
 from flask import Blueprint, render_template, request, jsonify, send_file, flash, redirect, url_for, current_app, Response
 from flask_login import login_required, current_user
 from datetime import datetime, timezone
 from app import db
 from app.models import User, CompilationHistory
-from app.compiler import TypstRealtimeCompiler
+from app.compiler import TypstRealtimeCompiler, create_backend
+from app.executor import compile_executor
+from app.metrics import metrics
+from app.artifacts import artifact_store
+from app.svg import optimize_svg
+from app.repository import history_repository, InvalidCursor
 
 
 # create blueprint of main routes
 main = Blueprint("main", __name__)
 
+# ids of favorites being rendered by a request of this process
+rendering_history = set()
+rendering_history_lock = threading.Lock()
+
+
+
+@main.route("/metrics")
+def metrics_export():
+    """ Prometheus Metrics of this Worker """
+    if not current_app.config.get('METRICS_ENABLED', True):
+        return "Not Found", 404
+    # scrapers authenticate with a bearer token when one is set
+    token = current_app.config.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return "Unauthorized", 401
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 
 @main.route("/")
@@ -104,9 +126,62 @@ def profile():
 @main.route("/history")
 @login_required
 def history():
-    """ Compilation History """
-    history_items = CompilationHistory.query.filter_by(user_id=current_user.id).order_by(CompilationHistory.created_at.desc()).all()
-    return render_template("user/history.html", history_items=history_items)
+    """ Compilation History, first page, the rest is loaded on scroll """
+    history_items, next_cursor = history_repository.page(
+        current_user.id,
+        limit=current_app.config.get('HISTORY_PAGE_SIZE', 20)
+    )
+    return render_template("user/history.html", history_items=history_items, next_cursor=next_cursor)
+
+
+@main.route("/api/history")
+@login_required
+def history_page():
+    """ Page of Compilation History after ?cursor= """
+    limit = min(request.args.get('limit', current_app.config.get('HISTORY_PAGE_SIZE', 20), type=int), 100)
+    try:
+        items, next_cursor = history_repository.page(current_user.id, request.args.get('cursor'), max(limit, 1))
+    except InvalidCursor as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify({
+        "status": "success",
+        "items": [history_item_json(item) for item in items],
+        "next_cursor": next_cursor
+    })
+
+
+@main.route("/api/history/search")
+@login_required
+def search_history():
+    """ Search Compilation History, ?q=&page= """
+    query = request.args.get('q', '')
+    if not query.strip():
+        return jsonify({"status": "error", "message": "No search query provided."}), 400
+    page = max(request.args.get('page', 1, type=int), 1)
+    limit = min(max(request.args.get('limit', current_app.config.get('HISTORY_PAGE_SIZE', 20), type=int), 1), 100)
+    hits, has_more = history_repository.search(current_user.id, query, page, limit)
+    return jsonify({
+        "status": "success",
+        "query": query,
+        "items": [{
+            **history_item_json(hit['item']),
+            "score": hit['score'],
+            "fragments": hit['fragments']
+        } for hit in hits],
+        "page": page,
+        "next_page": page + 1 if has_more else None
+    })
+
+
+def history_item_json(item):
+    """ Compilation History Item for the API """
+    return {
+        "id": item.id,
+        "typst_code": item.typst_code,
+        "current_environment": item.current_environment,
+        "created_at": item.created_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
+        "image_url": url_for('main.compile_typst_history', history_id=item.id, v=item.artifact_hash)
+    }
 
 
 @main.route("/api/like", methods=["POST"])
@@ -119,16 +194,19 @@ def add_history():
         env = data.get('env')
         if not code or not env:
             return jsonify({"status": "error", "message": "No code or environment provided.", "category": "danger"}), 400
-        # create new history
-        new_history = CompilationHistory(
-            user_id=current_user.id,
-            typst_code=code,
-            current_environment=env
-        )
+        # same content saved before: it only moves to the top
+        history, created = history_repository.save(current_user.id, code, env)
+        # render once now, the favorites page serves the stored SVG
+        if not has_artifact(history):
+            try:
+                store_history_artifacts([history])
+            except OSError as e:
+                # the favorites page renders it on first view
+                print(f'[History Artifact] Store Failed: {e}')
         # commit the changes
-        db.session.add(new_history)
         db.session.commit()
-        return jsonify({"status": "success", "message": "Saved to My Favorites!", "category": "success"})
+        message = "Saved to My Favorites!" if created else "Already in My Favorites, moved to the top!"
+        return jsonify({"status": "success", "message": message, "category": "success"})
     except Exception as e:
         db.session.rollback()
         return jsonify({"status": "error", "message": str(e), "category": "danger"}), 500
@@ -146,6 +224,7 @@ def delete_history(history_id):
         # commit the delete
         db.session.delete(item)
         db.session.commit()
+        release_artifact(item.artifact_hash, item.output_format)
         return jsonify({"status": "success", "message": "Removed from favorites."})
     except Exception as e:
         db.session.rollback()
@@ -156,37 +235,147 @@ def delete_history(history_id):
 @main.route("/history/image/<int:history_id>")
 @login_required
 def compile_typst_history(history_id):
-    """ Compile Typst """
+    """ Rendered Favorite, from the Artifact Store """
     item = CompilationHistory.query.get_or_404(history_id)
     
     # check user id
     if item.user_id != current_user.id:
         return "Unauthorized", 403
-
-    # three diff environments
-    code_content = item.typst_code
-    if item.current_environment == 'inline-formula':
-        code_content = f"${item.typst_code}$"
-    if item.current_environment == 'interline-formula':
-        code_content = f"$ {item.typst_code} $"
-        
+    
     try:
-        with TypstRealtimeCompiler(user_id=current_user.id, session_id='history-compile') as compiler:
-            result = compiler.compile_to_svg(code_content)
-            if result['success']:
-                svg_data = result['svg']
-                return Response(svg_data, mimetype='image/svg+xml')
-            else:
+        # favorites saved before artifacts, or whose render failed: render now and keep it,
+        # together with other unrendered favorites of the page in one batch
+        if not has_artifact(item):
+            batch_size = current_app.config.get('HISTORY_BATCH_SIZE', 32)
+            others = CompilationHistory.query.filter(
+                CompilationHistory.user_id == current_user.id,
+                CompilationHistory.id != item.id,
+                db.or_(CompilationHistory.artifact_hash.is_(None), CompilationHistory.output_format == '')
+            ).order_by(CompilationHistory.created_at.desc()).limit(batch_size - 1).all()
+            # parallel lazy images skip favorites another request is already rendering,
+            # the requested one is rendered regardless
+            claimed = claim_history_renders([item, *others])
+            try:
+                result = store_history_artifacts([item, *[other for other in claimed if other is not item]])[0]
+                db.session.commit()
+            finally:
+                release_history_renders(claimed)
+            if not result['success']:
                 print(f'[History Compile Error] {result["error"]}')
                 error_svg = f'<svg xmlns="http://www.w3.org/2000/svg" width="200" height="30"><text x="0" y="20" fill="red" font-family="monospace">Compile Error</text></svg>'
-                return Response(error_svg, mimetype='image/svg+xml')
+                return Response(error_svg, mimetype='image/svg+xml', headers={'Cache-Control': 'no-store'})
+        return send_artifact(item.artifact_hash, item.output_format)
     except Exception as e:
+        db.session.rollback()
         print(f'[History Compile Error] {e}')
-        return Response('<svg><text>System Error</text></svg>', mimetype='image/svg+xml')
+        return Response('<svg><text>System Error</text></svg>', mimetype='image/svg+xml', headers={'Cache-Control': 'no-store'})
+
+
+@main.route("/api/history/thumbnails")
+@login_required
+def history_thumbnails():
+    """ Rendered Favorites as SVG Text, ?ids=1,2,3 or the latest ones """
+    query = CompilationHistory.query.filter_by(user_id=current_user.id)
+    ids = [int(history_id) for history_id in request.args.get('ids', '').split(',') if history_id.strip().isdigit()]
+    limit = current_app.config.get('HISTORY_THUMBNAIL_LIMIT', 50)
+    if ids:
+        query = query.filter(CompilationHistory.id.in_(ids[:limit]))
+    items = query.order_by(CompilationHistory.created_at.desc()).limit(limit).all()
+    
+    try:
+        # unrendered favorites share one typst run
+        missing = [item for item in items if not has_artifact(item)]
+        failed = {}
+        if missing:
+            # the items are needed here, claiming them keeps lazy image batches off them
+            claimed = claim_history_renders(missing)
+            try:
+                for item, result in zip(missing, store_history_artifacts(missing)):
+                    if not result['success']:
+                        failed[item.id] = result['error']
+                db.session.commit()
+            finally:
+                release_history_renders(claimed)
         
+        # thumbnails are small previews, numbers are cut like in the editor
+        precision = current_app.config.get('SVG_OPTIMIZE_PRECISION', 2)
+        thumbnails = []
+        for item in items:
+            if item.id in failed:
+                thumbnails.append({"id": item.id, "success": False, "error": failed[item.id]})
+                continue
+            svg = artifact_store.read(item.artifact_hash, item.output_format)
+            thumbnails.append({"id": item.id, "success": True, "svg": optimize_svg(svg, 'aggressive', precision)})
+        return jsonify({"status": "success", "thumbnails": thumbnails})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+def compile_history(snippets):
+    """ One-off Compile of Favorites, (typst_code, env) snippets share one typst run """
+    # a watch child would not outlive the request
+    backend_name = current_app.config.get('TYPST_BACKEND')
+    if backend_name == 'watch':
+        backend_name = 'cli'
+    
+    with TypstRealtimeCompiler(
+        user_id=current_user.id,
+        session_id='history-compile',
+        backend=create_backend(current_app.config, backend_name)
+    ) as compiler:
+        return compile_executor.run(
+            compiler.compile_batch,
+            snippets,
+            optimize=current_app.config.get('SVG_OPTIMIZE_HISTORY', 'lossless'),
+            precision=current_app.config.get('SVG_OPTIMIZE_PRECISION', 2)
+        )
+
+
+def has_artifact(item):
+    return bool(item.output_format) and artifact_store.exists(item.artifact_hash, item.output_format)
+
+
+def store_history_artifacts(items):
+    """ Render Favorites into the Artifact Store, the caller commits the items """
+    results = compile_history([(item.typst_code, item.current_environment) for item in items])
+    for item, result in zip(items, results):
+        if result['success']:
+            item.artifact_hash = artifact_store.put(result['svg'], 'svg')
+            item.output_format = 'svg'
+    return results
+
+
+def claim_history_renders(items):
+    """ Mark Favorites as rendering, returns the ones no other request is rendering """
+    with rendering_history_lock:
+        claimed = [item for item in items if item.id not in rendering_history]
+        rendering_history.update(item.id for item in claimed)
+    return claimed
 
 
+def release_history_renders(items):
+    with rendering_history_lock:
+        rendering_history.difference_update(item.id for item in items)
 
 
+def release_artifact(artifact_hash, output_format=None):
+    """ Delete an Artifact once no Favorite uses it, artifacts are shared by favorites with the same render """
+    if artifact_hash and not CompilationHistory.query.filter_by(artifact_hash=artifact_hash).first():
+        artifact_store.delete(artifact_hash, output_format or 'svg')
 
 
+def send_artifact(artifact_hash, output_format='svg'):
+    """ Serve an Artifact, its content hash is the ETag and it never changes """
+    response = send_file(
+        artifact_store.path(artifact_hash, output_format),
+        mimetype='image/svg+xml',
+        etag=artifact_hash,
+        conditional=True,
+        max_age=current_app.config.get('ARTIFACT_MAX_AGE', 31536000)
+    )
+    # favorites are per user, browsers may keep them but shared caches may not
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
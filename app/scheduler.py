@@ -0,0 +1,125 @@
+import os
+import threading
+from collections import OrderedDict, deque
+
+
+class CompileScheduler:
+    """Global Compile Scheduler with per-User Fair Queueing"""
+    def __init__(self, workers=None, max_queue_depth=8):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue_depth = max_queue_depth
+        self.socketio = None
+        self.lock = threading.Lock()
+        # {user_id: deque([(session_id, job), ...])}, served round-robin
+        self.queues = OrderedDict()
+        self.signal = None
+        self.started = False
+        self.running = 0
+        self.rejected = 0
+        self.coalesced = 0
+
+    def init_app(self, app, socketio):
+        """read scheduler config"""
+        self.socketio = socketio
+        self.workers = app.config.get('COMPILE_WORKERS') or self.workers
+        self.max_queue_depth = app.config.get('COMPILE_QUEUE_DEPTH', self.max_queue_depth)
+
+    def submit(self, user_id, session_id, job, coalesce=False, on_accept=None):
+        """
+        queue a compile job, return False when the user's queue is full
+
+        a rejected job changes nothing, on_accept runs once the job is
+        accepted and before a worker can start it
+        """
+        self._start()
+        with self.lock:
+            queue = self.queues.get(user_id)
+            if queue is None:
+                queue = self.queues[user_id] = deque()
+            # latest wins: queued jobs of the same session are dropped once this one is in
+            remaining = queue
+            if coalesce and queue:
+                remaining = deque(item for item in queue if item[0] != session_id)
+            if len(remaining) >= self.max_queue_depth:
+                self.rejected += 1
+                return False
+            self.coalesced += len(queue) - len(remaining)
+            queue = self.queues[user_id] = remaining
+            if on_accept:
+                on_accept()
+            queue.append((session_id, job))
+        # wake one worker per queued job
+        self.signal.put(None)
+        return True
+
+    def discard_session(self, user_id, session_id):
+        """drop queued jobs of a closed session"""
+        with self.lock:
+            queue = self.queues.get(user_id)
+            if not queue:
+                return
+            remaining = deque(item for item in queue if item[0] != session_id)
+            if remaining:
+                self.queues[user_id] = remaining
+            else:
+                del self.queues[user_id]
+
+    def depth(self):
+        """number of queued jobs"""
+        with self.lock:
+            return sum(len(queue) for queue in self.queues.values())
+
+    def stats(self):
+        with self.lock:
+            return {
+                'workers': self.workers,
+                'running': self.running,
+                'queued': sum(len(queue) for queue in self.queues.values()),
+                'queued_users': len(self.queues),
+                'rejected': self.rejected,
+                'coalesced': self.coalesced
+            }
+
+    def _start(self):
+        """start worker tasks on first use, in the SocketIO async mode"""
+        if self.started:
+            return
+        with self.lock:
+            if self.started:
+                return
+            self.signal = self.socketio.server.eio.create_queue()
+            for _ in range(self.workers):
+                self.socketio.start_background_task(self._worker)
+            self.started = True
+            print(f'[Scheduler] Start Compile Workers | Workers: {self.workers} | Max Queue Depth: {self.max_queue_depth}')
+
+    def _next_job(self):
+        """pop the next job, one user at a time"""
+        with self.lock:
+            if not self.queues:
+                return None
+            user_id, queue = self.queues.popitem(last=False)
+            _, job = queue.popleft()
+            # user goes to the back of the line
+            if queue:
+                self.queues[user_id] = queue
+            self.running += 1
+            return job
+
+    def _worker(self):
+        while True:
+            self.signal.get()
+            job = self._next_job()
+            if job is None:
+                continue
+            try:
+                job()
+            except Exception as e:
+                print(f'[Scheduler] Compile Job Error: {e}')
+            finally:
+                with self.lock:
+                    self.running -= 1
+
+
+# shared scheduler instance
+compile_scheduler = CompileScheduler()
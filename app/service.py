@@ -0,0 +1,270 @@
+import os
+import socket
+import struct
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from app.backends import CompileBackend, CompileCancelled
+from app.tracing import compile_tracer
+
+# frame: header (kind, request id, payload length) + utf-8 payload
+FRAME_HEADER = struct.Struct('!BII')
+# requests
+COMPILE = 1
+CANCEL = 2
+# replies
+SUCCESS = 11
+FAILURE = 12
+CANCELLED = 13
+TIMEOUT = 14
+
+
+def send_frame(sock, kind, request_id, text=''):
+    payload = text.encode('utf-8')
+    sock.sendall(FRAME_HEADER.pack(kind, request_id, len(payload)) + payload)
+
+
+def read_frame(reader):
+    """(kind, request id, text) from a buffered reader, None when the peer is gone"""
+    header = reader.read(FRAME_HEADER.size)
+    if len(header) < FRAME_HEADER.size:
+        return None
+    kind, request_id, length = FRAME_HEADER.unpack(header)
+    payload = reader.read(length)
+    if len(payload) < length:
+        return None
+    return kind, request_id, payload.decode('utf-8')
+
+
+class PendingRequest:
+    """Reply slot of one request"""
+    def __init__(self):
+        self.event = threading.Event()
+        self.reply = None
+
+    def resolve(self, kind, text):
+        self.reply = (kind, text)
+        self.event.set()
+
+
+class ServiceConnection:
+    """Unix Socket to the Compile Service, shared by all Sessions of a Web Worker"""
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self.lock = threading.Lock()
+        self.sock = None
+        self.next_id = 0
+        # {request_id: pending_request}
+        self.pending = {}
+
+    def request(self, text):
+        """send a compile request, return (request id, pending request)"""
+        with self.lock:
+            self.next_id = (self.next_id + 1) % 2 ** 32
+            request_id = self.next_id
+            pending = self.pending[request_id] = PendingRequest()
+            try:
+                send_frame(self._connect(), COMPILE, request_id, text)
+            except OSError:
+                del self.pending[request_id]
+                self._close()
+                raise
+        return request_id, pending
+
+    def cancel(self, request_id):
+        with self.lock:
+            if request_id in self.pending and self.sock is not None:
+                try:
+                    send_frame(self.sock, CANCEL, request_id)
+                except OSError:
+                    self._close()
+
+    def forget(self, request_id):
+        with self.lock:
+            self.pending.pop(request_id, None)
+
+    def _connect(self):
+        if self.sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.socket_path)
+            self.sock = sock
+            threading.Thread(target=self._read_replies, args=(sock,), daemon=True).start()
+            print(f'[Compile Service] Connected | Socket: {self.socket_path}')
+        return self.sock
+
+    def _close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+
+    def _read_replies(self, sock):
+        reader = sock.makefile('rb')
+        while True:
+            try:
+                frame = read_frame(reader)
+            except OSError:
+                frame = None
+            if frame is None:
+                break
+            kind, request_id, text = frame
+            with self.lock:
+                pending = self.pending.pop(request_id, None)
+            if pending:
+                pending.resolve(kind, text)
+
+        # service gone: fail waiting requests, the next request reconnects
+        with self.lock:
+            if self.sock is sock:
+                self._close()
+            pending, self.pending = self.pending, {}
+        for request in pending.values():
+            request.resolve(None, 'Compile Service Disconnected')
+
+
+_connections = {}
+_connections_lock = threading.Lock()
+
+
+def get_service_connection(socket_path):
+    """shared connection per socket path"""
+    with _connections_lock:
+        if socket_path not in _connections:
+            _connections[socket_path] = ServiceConnection(socket_path)
+        return _connections[socket_path]
+
+
+class ServiceBackend(CompileBackend):
+    """Compile in the standalone Compile Service, which also owns the Render Cache"""
+    shared_cache = True
+
+    def __init__(self, socket_path, timeout=5):
+        self.connection = get_service_connection(socket_path)
+        self.timeout = timeout
+        self.request_id = None
+
+    def compile(self, full_code):
+        request_id, pending = self.connection.request(full_code)
+        self.request_id = request_id
+        try:
+            # the service enforces the compile timeout, the margin covers queueing
+            with compile_tracer.phase('exec'):
+                replied = pending.event.wait(self.timeout * 2 + 1)
+            if not replied:
+                self.connection.forget(request_id)
+                raise subprocess.TimeoutExpired('compile service', self.timeout)
+        finally:
+            self.request_id = None
+
+        kind, text = pending.reply
+        if kind == SUCCESS:
+            return True, text
+        if kind == FAILURE:
+            return False, text
+        if kind == CANCELLED:
+            raise CompileCancelled()
+        if kind == TIMEOUT:
+            raise subprocess.TimeoutExpired('compile service', self.timeout)
+        raise ConnectionError(text)
+
+    def cancel(self):
+        request_id = self.request_id
+        if request_id is not None:
+            self.connection.cancel(request_id)
+
+
+class CompileService:
+    """Standalone Compile Service: a pool of Typst Compilers behind a Unix Socket"""
+    def __init__(self, socket_path, compiler_factory, workers=None):
+        self.socket_path = socket_path
+        self.workers = workers or os.cpu_count() or 1
+        # idle compilers, each keeps its backend warm
+        self.compilers = [compiler_factory() for _ in range(self.workers)]
+        self.idle = list(self.compilers)
+        self.condition = threading.Condition()
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        # {(client, request_id): compiler} running, queued requests map to None
+        self.requests = {}
+        self.served = 0
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o660)
+        server.listen()
+        print(f'[Compile Service] Listening | Socket: {self.socket_path} | Workers: {self.workers}')
+        try:
+            while True:
+                client, _ = server.accept()
+                threading.Thread(target=self._serve_client, args=(client,), daemon=True).start()
+        finally:
+            server.close()
+            os.unlink(self.socket_path)
+            for compiler in self.compilers:
+                compiler.cleanup()
+
+    def _serve_client(self, client):
+        """read requests of one web worker"""
+        reader = client.makefile('rb')
+        write_lock = threading.Lock()
+
+        def reply(kind, request_id, text=''):
+            try:
+                with write_lock:
+                    send_frame(client, kind, request_id, text)
+            except OSError:
+                pass
+
+        while True:
+            try:
+                frame = read_frame(reader)
+            except OSError:
+                frame = None
+            if frame is None:
+                break
+            kind, request_id, text = frame
+            key = (client, request_id)
+            if kind == COMPILE:
+                with self.condition:
+                    self.requests[key] = None
+                self.executor.submit(self._compile, key, text, reply)
+            elif kind == CANCEL:
+                with self.condition:
+                    compiler = self.requests.get(key, False)
+                    if compiler is None:
+                        # not started: drop it
+                        del self.requests[key]
+                        reply(CANCELLED, request_id)
+                if compiler:
+                    compiler.cancel()
+        client.close()
+
+    def _compile(self, key, full_code, reply):
+        request_id = key[1]
+        with self.condition:
+            if key not in self.requests:
+                return
+            self.condition.wait_for(lambda: self.idle)
+            compiler = self.requests[key] = self.idle.pop()
+
+        try:
+            success, output = compiler.compile_source(full_code)
+            reply(SUCCESS if success else FAILURE, request_id, output)
+        except CompileCancelled:
+            reply(CANCELLED, request_id)
+        except subprocess.TimeoutExpired:
+            reply(TIMEOUT, request_id)
+        except FileNotFoundError:
+            reply(FAILURE, request_id, 'Typst do not in PATH!')
+        except Exception as e:
+            reply(FAILURE, request_id, f'Compile Error: {str(e)}')
+        finally:
+            with self.condition:
+                self.requests.pop(key, None)
+                self.idle.append(compiler)
+                self.served += 1
+                self.condition.notify()
@@ -4,10 +4,16 @@ import { EditorAPI } from './editor.js';
 
 // Configuration
 const COMPILE_DELAY = 0; // Debounce delay in ms
+const RESULT_ENCODING = typeof DecompressionStream !== 'undefined' ? 'deflate' : null; // Compressed results
 
 // State
 let socket = null;
 let compileTimeout = null;
+let compileDelay = COMPILE_DELAY; // Debounce delay in ms, recommended by the server
+let compileSeq = 0; // Sequence number of the latest compile request
+let svgState = null; // Last SVG from server: { id, rootTag, element }
+let resultChain = Promise.resolve(); // Results are decoded asynchronously, but handled in order
+let glyphStore = null; // Hidden <defs> holding every glyph symbol of this page, shared by all previews
 
 // DOM Elements
 const previewArea = document.getElementById('preview-area');
@@ -62,25 +68,25 @@ function initSocket() {
     // 2. Server Confirmation
     socket.on('connected', function(data) {
         console.log('[Socket.IO] Server Message:', data.message);
+        applyDebounce(data.debounce);
     });
     
     // 3. Receive Compile Result
     socket.on('compile_result', function(result) {
-        if (result.success) {
-            // Update SVG Preview
-            if (previewArea) previewArea.innerHTML = result.svg;
-            if (errorArea) errorArea.textContent = '';
-        } else {
-            // Show Error
-            // Only show "Compile Failed" if it's a real error, not just empty
-            if (result.error && result.error !== 'Typst Code is Empty') {
-                if (previewArea) previewArea.innerHTML = '<p style="color: #666; opacity: 0.7;">(Preview outdated)</p>';
-                if (errorArea) errorArea.textContent = result.error;
-            }
-        }
+        resultChain = resultChain
+            .then(() => applyDebounce(result.debounce))
+            .then(() => decodeResult(result))
+            .then(handleCompileResult)
+            .catch(error => console.error('[Compile] Failed to handle result:', error));
     });
     
-    // 4. Connect Error
+    // 4. Throttled: the server holds the latest request back, slow down
+    socket.on('throttled', function(data) {
+        console.warn(`[Compile] Throttled, retry after ${data.retry_after}s`);
+        applyDebounce(Math.max(compileDelay, data.debounce || 0));
+    });
+    
+    // 5. Connect Error
     socket.on('connect_error', function(error) {
         console.error('[Socket.IO] Connect error:', error);
         if (errorArea) errorArea.textContent = 'Connection Error';
@@ -95,7 +101,7 @@ function initSocket() {
         }
     });
     
-    // 5. Disconnect
+    // 6. Disconnect
     socket.on('disconnect', function(reason) {
         console.log('[Socket.IO] Disconnected:', reason);
         if (reason === 'io server disconnect') {
@@ -104,7 +110,7 @@ function initSocket() {
         if (errorArea) errorArea.textContent = 'Disconnected, Reconnecting...';
     });
     
-    // 6. Reconnect Success
+    // 7. Reconnect Success
     socket.on('reconnect', function(attemptNumber) {
         console.log('[Socket.IO] Reconnected after', attemptNumber, 'attempts');
         if (errorArea) errorArea.textContent = '';
@@ -112,14 +118,197 @@ function initSocket() {
     });
 }
 
+/**
+ * Use the debounce recommended by the server
+ */
+function applyDebounce(debounce) {
+    if (typeof debounce !== 'number' || debounce === compileDelay) return;
+    console.log(`[Compile] Debounce: ${debounce}ms`);
+    compileDelay = debounce;
+}
+
+/**
+ * Handle a decoded compile result
+ */
+function handleCompileResult(result) {
+    // Keep SVG state in step with the server, even for superseded results
+    let element = null;
+    if (result.success) {
+        element = result.patch ? applySvgPatch(result.patch) : loadSvg(result.svg, result.svg_id);
+        if (!element) {
+            console.warn('[Compile] SVG patch mismatch, requesting full SVG');
+            socket.emit('svg_resync', { encoding: RESULT_ENCODING, glyphs: true });
+            return;
+        }
+        adoptGlyphs(element);
+        if (!hasGlyphs(result.glyphs)) {
+            console.warn('[Compile] Missing glyphs, requesting full SVG');
+            socket.emit('svg_resync', { encoding: RESULT_ENCODING, glyphs: true, reset_glyphs: true });
+            return;
+        }
+    }
+    // Ignore results superseded by a newer request
+    if (result.seq !== undefined && result.seq < compileSeq) return;
+    if (result.success) {
+        // Update SVG Preview
+        if (previewArea && element.parentNode !== previewArea) previewArea.replaceChildren(element);
+        if (errorArea) errorArea.textContent = '';
+    } else if (result.incomplete) {
+        // Still typing: keep the last good SVG
+        if (errorArea) errorArea.textContent = result.error;
+    } else {
+        // Show Error
+        // Only show "Compile Failed" if it's a real error, not just empty
+        if (result.error && result.error !== 'Typst Code is Empty') {
+            if (previewArea) previewArea.innerHTML = '<p style="color: #666; opacity: 0.7;">(Preview outdated)</p>';
+            if (errorArea) errorArea.textContent = result.error;
+        }
+    }
+}
+
+/**
+ * Inflate a deflate-compressed binary attachment to text
+ */
+async function inflateText(data) {
+    const stream = new Blob([data]).stream().pipeThrough(new DecompressionStream('deflate'));
+    return await new Response(stream).text();
+}
+
+/**
+ * Decode compressed fields of a compile result
+ */
+async function decodeResult(result) {
+    if (result.svg_deflate) {
+        result.svg = await inflateText(result.svg_deflate);
+        delete result.svg_deflate;
+    }
+    if (result.patch_deflate) {
+        result.patch = JSON.parse(await inflateText(result.patch_deflate));
+        delete result.patch_deflate;
+    }
+    return result;
+}
+
+/**
+ * Parse SVG markup inside the current root tag, return its top-level nodes
+ */
+function parseSvgNodes(markup, rootTag) {
+    const doc = new DOMParser().parseFromString(`${rootTag}${markup}</svg>`, 'image/svg+xml');
+    return Array.from(doc.documentElement.children).map(node => document.importNode(node, true));
+}
+
+/**
+ * Load a full SVG from the server
+ */
+function loadSvg(svgText, svgId) {
+    const rootStart = svgText.indexOf('<svg');
+    const rootTag = svgText.slice(rootStart, svgText.indexOf('>', rootStart) + 1);
+    const template = document.createElement('template');
+    template.innerHTML = svgText;
+    const element = template.content.querySelector('svg');
+    svgState = element ? { id: svgId, rootTag, element } : null;
+    return element;
+}
+
+/**
+ * Apply a structural SVG patch, return null when it does not fit the current SVG
+ */
+function applySvgPatch(patch) {
+    if (!svgState || svgState.id !== patch.base) return null;
+    try {
+        const svg = svgState.element;
+
+        // 1. Root attributes (size / viewBox)
+        if (patch.root) {
+            const root = parseSvgRoot(patch.root);
+            Array.from(svg.attributes).forEach(attr => svg.removeAttribute(attr.name));
+            Array.from(root.attributes).forEach(attr => svg.setAttribute(attr.name, attr.value));
+            svgState.rootTag = patch.root;
+        }
+
+        // 2. Defs: remove unused, add new
+        let defs = svg.querySelector(':scope > defs:last-of-type');
+        patch.defs_remove.forEach(id => {
+            const node = svg.querySelector(`:scope > defs > [id="${CSS.escape(id)}"]`);
+            if (node) node.remove();
+        });
+        if (patch.defs_add.length) {
+            if (!defs) defs = svg.appendChild(document.createElementNS('http://www.w3.org/2000/svg', 'defs'));
+            parseSvgNodes(patch.defs_add.join(''), svgState.rootTag).forEach(node => defs.appendChild(node));
+        }
+
+        // 3. Body: copy runs of old elements, parse new ones
+        const oldBody = Array.from(svg.children).filter(node => node.localName !== 'defs');
+        const newBody = [];
+        patch.body.forEach(op => {
+            if (Array.isArray(op)) newBody.push(...oldBody.slice(op[0], op[0] + op[1]));
+            else newBody.push(...parseSvgNodes(op, svgState.rootTag));
+        });
+        oldBody.forEach(node => node.remove());
+        const anchor = svg.querySelector(':scope > defs');
+        newBody.forEach(node => svg.insertBefore(node, anchor));
+
+        svgState.id = patch.id;
+        return svg;
+    } catch (error) {
+        console.error('[Compile] Failed to apply SVG patch:', error);
+        svgState = null;
+        return null;
+    }
+}
+
+/**
+ * Hidden SVG whose <defs> keeps glyph symbols between compiles,
+ * <use> in the preview resolves #ids document-wide
+ */
+function getGlyphStore() {
+    if (!glyphStore) {
+        const svg = document.createElementNS('http://www.w3.org/2000/svg', 'svg');
+        svg.setAttribute('aria-hidden', 'true');
+        svg.style.cssText = 'position: absolute; width: 0; height: 0; overflow: hidden;';
+        glyphStore = svg.appendChild(document.createElementNS('http://www.w3.org/2000/svg', 'defs'));
+        document.body.appendChild(svg);
+    }
+    return glyphStore;
+}
+
+/**
+ * Move glyph symbols of an SVG into the glyph store
+ */
+function adoptGlyphs(svg) {
+    const store = getGlyphStore();
+    svg.querySelectorAll(':scope > defs > symbol[id]').forEach(symbol => {
+        if (store.querySelector(`:scope > [id="${CSS.escape(symbol.id)}"]`)) symbol.remove();
+        else store.appendChild(symbol);
+    });
+}
+
+/**
+ * Check the glyph store holds every glyph a result references
+ */
+function hasGlyphs(glyphIds) {
+    if (!glyphIds || !glyphIds.length) return true;
+    const store = getGlyphStore();
+    return glyphIds.every(id => store.querySelector(`:scope > [id="${CSS.escape(id)}"]`));
+}
+
+/**
+ * Parse a standalone SVG root tag
+ */
+function parseSvgRoot(rootTag) {
+    return new DOMParser().parseFromString(`${rootTag}</svg>`, 'image/svg+xml').documentElement;
+}
+
 /**
  * Send compile request to server
  * Uses CodeMirrorAPI to get the source of truth
  */
 function compileCode() {
     // 1. Get code from API (Source of Truth)
-    let code = CodeMirrorAPI.getValue().trim();
+    const code = CodeMirrorAPI.getValue().trim();
     const env = EditorAPI.getCurrentEnvironment();
+    // Every edit supersedes pending results, even an empty one
+    compileSeq += 1;
     
     // 2. Handle empty code
     if (!code) {
@@ -129,17 +318,11 @@ function compileCode() {
     }
     
     // 3. Emit if connected
-    // change code according to environment
-    if (env === 'inline-formula') {
-        code = `$${code}$`
-    }
-    if (env === 'interline-formula') {
-        code = `$ ${code} $`
-    }
+    // the server wraps code according to environment
     console.log(`[Compile] Environment: ${env}, Payload: ${code}`);
 
     if (socket && socket.connected) {
-        socket.emit('compile', { code: code });
+        socket.emit('compile', { code: code, env: env, seq: compileSeq, patch: true, glyphs: true, encoding: RESULT_ENCODING });
     } else {
         // Silent fail or minimal UI update if just typing
         errorArea.textContent = 'Socket Unconnected. Try to Reconnect...';
@@ -156,7 +339,7 @@ function debouncedCompile() {
     if (compileTimeout) {
         clearTimeout(compileTimeout);
     }
-    compileTimeout = setTimeout(compileCode, COMPILE_DELAY);
+    compileTimeout = setTimeout(compileCode, compileDelay);
 }
 
 /**
@@ -0,0 +1,324 @@
+import re
+import json
+import difflib
+import threading
+
+# Tags and comments of Typst SVG output, quoted attribute values may contain '>'
+TAG_PATTERN = re.compile(r'<!--.*?-->|<(/?)([A-Za-z][\w:.-]*)((?:[^>"\']|"[^"]*"|\'[^\']*\')*?)(/?)>', re.S)
+ID_PATTERN = re.compile(r'\sid="([^"]*)"')
+
+# Optimizer Tokens: comments and tags, text between tags, a stray '<'
+TOKEN_PATTERN = re.compile(TAG_PATTERN.pattern + r'|[^<]+|<', re.S)
+ATTRIBUTE_PATTERN = re.compile(r'\s+([\w:.-]+)="([^"]*)"')
+LONG_COLOR_PATTERN = re.compile(r'#([0-9a-fA-F])\1([0-9a-fA-F])\2([0-9a-fA-F])\3')
+IDENTITY_TRANSFORMS = {'matrix(1 0 0 1 0 0)', 'translate(0)', 'translate(0 0)'}
+TRANSLATE_MATRIX_PATTERN = re.compile(r'matrix\(1 0 0 1 (-?[\d.]+) (-?[\d.]+)\)')
+# translation of a matrix(a b c d e f) or translate(x y) transform
+TRANSLATION_PATTERN = re.compile(r'(matrix\((?:\s*[-\d.e]+[\s,]+){4}|translate\(\s*)([^)]*)\)')
+PATH_SPACE_PATTERN = re.compile(r' (?=[-A-Za-z])|(?<=[A-Za-z]) ')
+SYMBOL_PATTERN = re.compile(r'<symbol id="([^"]+)".*?</symbol>', re.S)
+REFERENCE_PATTERN = re.compile(r'#([\w.-]+)')
+# bump when optimize_svg output changes, the disk render cache keys on it
+OPTIMIZER_VERSION = 2
+# elements whose text is rendered, whitespace in them is content
+TEXT_ELEMENTS = {'text', 'tspan', 'textPath', 'title', 'desc', 'style'}
+# attributes holding only coordinates and lengths (and units), aggressive precision rounds these,
+# of transforms only the translation: scale, rotation and skew terms multiply every coordinate
+NUMERIC_ATTRIBUTES = {
+    'd', 'viewBox', 'points', 'x', 'y', 'x1', 'y1', 'x2', 'y2',
+    'cx', 'cy', 'r', 'rx', 'ry', 'width', 'height', 'stroke-width'
+}
+
+
+def _children(svg, start, end):
+    """top-level elements of svg[start:end] as [(tag name, open tag end, element)]"""
+    children = []
+    depth = 0
+    element_start = name = open_end = None
+    for match in TAG_PATTERN.finditer(svg, start, end):
+        if match.group(2) is None:
+            # comment
+            continue
+        closing, tag, _, self_closing = match.group(1), match.group(2), match.group(3), match.group(4)
+        if depth == 0:
+            if closing:
+                return None
+            element_start, name, open_end = match.start(), tag, match.end()
+        if closing:
+            depth -= 1
+        elif not self_closing:
+            depth += 1
+        if depth == 0:
+            children.append((name, open_end - element_start, svg[element_start:match.end()]))
+    return children if depth == 0 else None
+
+
+def split_svg(svg):
+    """
+    split Typst SVG into (root tag, [body elements], {def id: def element})
+    return None when the SVG does not have this shape
+    """
+    root_start = svg.find('<svg')
+    root = TAG_PATTERN.match(svg, root_start) if root_start >= 0 else None
+    close_start = svg.rfind('</svg>')
+    if not root or close_start < root.end():
+        return None
+
+    children = _children(svg, root.end(), close_start)
+    if children is None:
+        return None
+
+    body, defs = [], {}
+    for name, open_length, element in children:
+        if name != 'defs':
+            body.append(element)
+            continue
+        # defs children are keyed by id, typst names glyphs and clip paths by content hash
+        def_children = _children(element, open_length, len(element) - len('</defs>'))
+        if def_children is None:
+            return None
+        for _, _, def_element in def_children:
+            match = ID_PATTERN.search(def_element[:def_element.find('>')])
+            if not match:
+                return None
+            defs[match.group(1)] = def_element
+    return svg[:root.end()], body, defs
+
+
+def diff_svg(old_parts, new_parts):
+    """structural diff of two split SVGs"""
+    old_root, old_body, old_defs = old_parts
+    new_root, new_body, new_defs = new_parts
+
+    # body: [start, count] copies a run of old elements, a string is a new element
+    body = []
+    matcher = difflib.SequenceMatcher(None, old_body, new_body, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            body.append([i1, i2 - i1])
+        elif j2 > j1:
+            body.extend(new_body[j1:j2])
+
+    return {
+        'root': new_root if new_root != old_root else None,
+        'body': body,
+        'defs_add': [element for def_id, element in new_defs.items() if def_id not in old_defs],
+        'defs_remove': [def_id for def_id in old_defs if def_id not in new_defs]
+    }
+
+
+def optimize_svg(svg, level='lossless', precision=2):
+    """
+    Shrink Typst SVG output in one pass over its tokens
+
+    lossless:   whitespace between tags, comments, default attributes, identity transforms, unused symbols
+    aggressive: lossless, plus coordinates and translations rounded to precision decimals
+    """
+    if not level:
+        return svg
+
+    # fill-rule inherits, so keep nonzero when evenodd is used anywhere
+    drop_nonzero = 'evenodd' not in svg
+    # round numbers with extra decimals, at most half of 10^-precision of a point off
+    long_number = None
+    if level == 'aggressive':
+        long_number = re.compile(r'-?\d*\.\d{%d,}' % (precision + 1))
+    # glyph outlines repeat their numbers
+    rounded_numbers = {}
+
+    def round_number(match):
+        number = match.group()
+        rounded = rounded_numbers.get(number)
+        if rounded is None:
+            rounded = f'{float(number):.{precision}f}'
+            if rounded[0] == '-' and not rounded.strip('-0.'):
+                rounded = rounded[1:]
+            rounded_numbers[number] = rounded
+        # ".5" after "1.25" is a second number, without decimals the two would merge
+        if not precision and number[0] == '.' and match.start() and match.string[match.start() - 1].isdigit():
+            return ' ' + rounded
+        return rounded
+
+    def round_translation(match):
+        return f'{match.group(1)}{long_number.sub(round_number, match.group(2))})'
+
+    references = set()
+
+    def attribute(match):
+        name, value = match.groups()
+        if name == 'transform':
+            if value in IDENTITY_TRANSFORMS:
+                return ''
+            translate = TRANSLATE_MATRIX_PATTERN.fullmatch(value)
+            if translate:
+                value = f'translate({translate.group(1)} {translate.group(2)})'
+            if long_number and '.' in value:
+                value = TRANSLATION_PATTERN.sub(round_translation, value)
+        elif name == 'd':
+            # path data: no spaces around commands and before signs
+            value = PATH_SPACE_PATTERN.sub('', value).strip()
+        elif (name == 'x' or name == 'y') and value == '0':
+            return ''
+        elif name == 'fill-rule' and value == 'nonzero' and drop_nonzero:
+            return ''
+        elif '#' in value:
+            color = LONG_COLOR_PATTERN.fullmatch(value)
+            if color:
+                value = '#' + ''.join(color.groups())
+            else:
+                references.update(REFERENCE_PATTERN.findall(value))
+        if long_number and '.' in value and name in NUMERIC_ATTRIBUTES:
+            value = long_number.sub(round_number, value)
+        return f' {name}="{value}"'
+
+    out = []
+    # (index in out, id) of open symbols, (start, end, id) of closed ones
+    open_symbols, symbols = [], []
+    open_defs, defs = [], []
+    # inside text elements whitespace is kept
+    text_depth = 0
+    for match in TOKEN_PATTERN.finditer(svg):
+        tag = match.group(2)
+        if tag is None:
+            token = match.group(0)
+            if token.startswith('<!--'):
+                continue
+            if text_depth or not token.isspace():
+                if '#' in token:
+                    references.update(REFERENCE_PATTERN.findall(token))
+                out.append(token)
+            continue
+
+        if match.group(1):
+            out.append(match.group(0))
+            if tag in TEXT_ELEMENTS and text_depth:
+                text_depth -= 1
+            elif tag == 'symbol' and open_symbols:
+                symbols.append((*open_symbols.pop(), len(out)))
+            elif tag == 'defs' and open_defs:
+                defs.append((open_defs.pop(), len(out)))
+            continue
+
+        attributes, self_closing = match.group(3), match.group(4)
+        if not self_closing:
+            if tag in TEXT_ELEMENTS:
+                text_depth += 1
+            elif tag == 'symbol':
+                symbol_id = ID_PATTERN.search(attributes)
+                open_symbols.append((len(out), symbol_id.group(1) if symbol_id else None))
+            elif tag == 'defs':
+                open_defs.append(len(out))
+        if attributes:
+            attributes = ATTRIBUTE_PATTERN.sub(attribute, attributes).rstrip()
+        out.append(f'<{tag}{attributes}{self_closing}>')
+
+    # unused glyph symbols, then defs left empty
+    for start, symbol_id, end in symbols:
+        if symbol_id and symbol_id not in references:
+            out[start:end] = [''] * (end - start)
+    for start, end in defs:
+        if not any(out[start + 1:end - 1]):
+            out[start] = out[end - 1] = ''
+    return ''.join(out)
+
+
+class SvgPatcher:
+    """Last SVG sent to one Session, encodes the next one as a Patch when smaller"""
+    def __init__(self, min_saving=0.2):
+        self.min_saving = min_saving
+        self.lock = threading.Lock()
+        self.version = 0
+        self.svg = None
+        self.parts = None
+        # counters
+        self.patches = 0
+        self.full = 0
+
+    def encode(self, svg):
+        """return the payload fields for svg: {'svg', 'svg_id'} or {'patch'}"""
+        with self.lock:
+            base = self.version
+            self.version += 1
+            parts = split_svg(svg)
+            payload = None
+
+            if parts and self.parts:
+                patch = diff_svg(self.parts, parts)
+                patch['base'] = base
+                patch['id'] = self.version
+                if len(json.dumps(patch)) < len(svg) * (1 - self.min_saving):
+                    payload = {'patch': patch}
+
+            self.svg, self.parts = svg, parts
+            if payload:
+                self.patches += 1
+                return payload
+            self.full += 1
+            return {'svg': svg, 'svg_id': self.version}
+
+    def resync(self):
+        """full payload of the last SVG, after the client reported a mismatch"""
+        with self.lock:
+            if self.svg is None:
+                return None
+            self.full += 1
+            return {'svg': self.svg, 'svg_id': self.version}
+
+
+class GlyphDictionary:
+    """Glyph symbols one Session already holds, later payloads only reference them"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.known = set()
+        # counters
+        self.sent = 0
+        self.reused = 0
+        self.saved_bytes = 0
+
+    def apply(self, payload):
+        """drop known glyphs from an encoded payload, list them in payload['glyphs']"""
+        with self.lock:
+            glyphs = []
+
+            def keep(glyph_id, element):
+                if glyph_id in self.known:
+                    glyphs.append(glyph_id)
+                    self.reused += 1
+                    self.saved_bytes += len(element)
+                    return False
+                self.known.add(glyph_id)
+                self.sent += 1
+                return True
+
+            if payload.get('svg'):
+                payload['svg'] = SYMBOL_PATTERN.sub(
+                    lambda match: match.group(0) if keep(match.group(1), match.group(0)) else '',
+                    payload['svg']
+                )
+            patch = payload.get('patch')
+            if patch:
+                defs_add = []
+                for element in patch['defs_add']:
+                    match = SYMBOL_PATTERN.match(element)
+                    if not match or keep(match.group(1), element):
+                        defs_add.append(element)
+                patch['defs_add'] = defs_add
+                # the client keeps glyphs for the whole session
+                patch['defs_remove'] = [def_id for def_id in patch['defs_remove'] if def_id not in self.known]
+
+            payload['glyphs'] = glyphs
+            return payload
+
+    def reset(self):
+        """client lost its glyphs, send them again"""
+        with self.lock:
+            self.known.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'known': len(self.known),
+                'sent': self.sent,
+                'reused': self.reused,
+                'saved_bytes': self.saved_bytes
+            }
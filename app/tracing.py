@@ -0,0 +1,266 @@
+import os
+import json
+import time
+import queue
+import random
+import threading
+import contextvars
+import urllib.request
+from contextlib import contextmanager
+from app.metrics import COMPILE_PHASE_SECONDS
+
+# (trace, parent span) of the running stage, per thread and per greenlet
+# (gevent runs socket handlers and workers as greenlets of one thread)
+_active = contextvars.ContextVar('compile_trace', default=(None, None))
+
+
+class Span:
+    """One timed stage of a Trace"""
+    __slots__ = ('name', 'span_id', 'parent_id', 'start_ns', 'end_ns', 'attributes')
+
+    def __init__(self, name, parent_id=None, start_ns=None, attributes=None):
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes or {}
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start_ns': self.start_ns,
+            'end_ns': self.end_ns,
+            'duration_ms': round((self.end_ns - self.start_ns) / 1e6, 3),
+            'attributes': self.attributes
+        }
+
+
+class Trace:
+    """Span Tree of one compile event, stages may run on different threads"""
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.trace_id = os.urandom(16).hex()
+        self.root = Span(name, attributes=attributes)
+        # finished spans
+        self.spans = [self.root]
+
+    def finish(self, **attributes):
+        """close the root span and hand the trace to the exporter"""
+        self.root.attributes.update(attributes)
+        self.root.end_ns = time.time_ns()
+        self.tracer.export(self)
+
+
+class JsonlExporter:
+    """One trace per line in a local file"""
+    def __init__(self, path):
+        self.path = path
+
+    def export(self, traces):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for trace in traces:
+                f.write(json.dumps({
+                    'trace_id': trace.trace_id,
+                    'name': trace.root.name,
+                    'duration_ms': round((trace.root.end_ns - trace.root.start_ns) / 1e6, 3),
+                    'spans': [span.to_dict() for span in trace.spans]
+                }, separators=(',', ':')) + '\n')
+
+
+class OtlpExporter:
+    """OTLP/HTTP JSON to a local collector"""
+    def __init__(self, endpoint, service_name='typstlive', timeout=2):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.timeout = timeout
+
+    def export(self, traces):
+        spans = [self._span(trace.trace_id, span) for trace in traces for span in trace.spans]
+        body = {
+            'resourceSpans': [{
+                'resource': {'attributes': self._attributes({'service.name': self.service_name})},
+                'scopeSpans': [{'scope': {'name': 'typstlive'}, 'spans': spans}]
+            }]
+        }
+        request = urllib.request.Request(
+            self.endpoint,
+            data=json.dumps(body).encode('utf-8'),
+            headers={'Content-Type': 'application/json'},
+            method='POST'
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+    def _span(self, trace_id, span):
+        otlp_span = {
+            'traceId': trace_id,
+            'spanId': span.span_id,
+            'name': span.name,
+            'kind': 1,
+            'startTimeUnixNano': str(span.start_ns),
+            'endTimeUnixNano': str(span.end_ns),
+            'attributes': self._attributes(span.attributes)
+        }
+        if span.parent_id:
+            otlp_span['parentSpanId'] = span.parent_id
+        return otlp_span
+
+    @staticmethod
+    def _attributes(attributes):
+        values = []
+        for key, value in attributes.items():
+            if isinstance(value, bool):
+                typed = {'boolValue': value}
+            elif isinstance(value, int):
+                typed = {'intValue': str(value)}
+            elif isinstance(value, float):
+                typed = {'doubleValue': value}
+            else:
+                typed = {'stringValue': str(value)}
+            values.append({'key': key, 'value': typed})
+        return values
+
+
+class CompileTracer:
+    """Opt-in sampled Tracing of compile events"""
+    def __init__(self, max_pending=256, batch_size=32):
+        self.sample_rate = 0.0
+        # users traced on every compile, e.g. while looking into a lag report
+        self.users = set()
+        self.exporter = None
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.batch_size = batch_size
+        self.started = False
+        self.lock = threading.Lock()
+        # counters
+        self.exported = 0
+        self.dropped = 0
+
+    def init_app(self, app):
+        """read tracing config"""
+        self.sample_rate = app.config.get('TRACE_SAMPLE_RATE', self.sample_rate)
+        self.users = {str(user_id) for user_id in app.config.get('TRACE_USERS') or ()}
+        if not self.sample_rate and not self.users:
+            self.exporter = None
+        elif app.config.get('TRACE_EXPORT') == 'otlp':
+            self.exporter = OtlpExporter(app.config.get('TRACE_OTLP_ENDPOINT'))
+        else:
+            self.exporter = JsonlExporter(app.config.get('TRACE_JSONL_PATH', 'traces.jsonl'))
+
+    def start(self, name, user_id=None, **attributes):
+        """new trace when this event is sampled, None otherwise"""
+        if self.exporter is None:
+            return None
+        if str(user_id) not in self.users and random.random() >= self.sample_rate:
+            return None
+        attributes['user_id'] = user_id
+        return Trace(self, name, attributes)
+
+    @contextmanager
+    def activate(self, trace, parent=None):
+        """make trace the current trace of this thread, new spans go under parent"""
+        token = _active.set((trace, parent or (trace.root if trace else None)))
+        try:
+            yield trace
+        finally:
+            _active.reset(token)
+
+    def wrap(self, func):
+        """func running under the current span, for another thread"""
+        trace, parent = _active.get()
+        if trace is None:
+            return func
+
+        def traced(*args, **kwargs):
+            with self.activate(trace, parent):
+                return func(*args, **kwargs)
+        return traced
+
+    def current(self):
+        return _active.get()[0]
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """span in the current trace, nothing when untraced"""
+        trace, parent = _active.get()
+        if trace is None:
+            yield None
+            return
+        span = Span(name, parent.span_id, attributes=attributes)
+        token = _active.set((trace, span))
+        try:
+            yield span
+        finally:
+            span.end_ns = time.time_ns()
+            _active.reset(token)
+            trace.spans.append(span)
+
+    def record(self, name, seconds, **attributes):
+        """add a finished span of seconds that ends now"""
+        trace, parent = _active.get()
+        if trace is None:
+            return
+        end_ns = time.time_ns()
+        span = Span(name, parent.span_id, end_ns - int(seconds * 1e9), attributes)
+        span.end_ns = end_ns
+        trace.spans.append(span)
+
+    @contextmanager
+    def phase(self, name):
+        """compile phase: always in the phase histogram, a span when traced"""
+        started = time.perf_counter()
+        try:
+            with self.span(name):
+                yield
+        finally:
+            COMPILE_PHASE_SECONDS.observe(time.perf_counter() - started, name)
+
+    def annotate(self, **attributes):
+        """attributes of the innermost span"""
+        trace, parent = _active.get()
+        if trace is not None:
+            parent.attributes.update(attributes)
+
+    def export(self, trace):
+        """queue a finished trace, dropped when the exporter falls behind"""
+        self._start()
+        try:
+            self.pending.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    def stats(self):
+        return {
+            'sample_rate': self.sample_rate,
+            'users': len(self.users),
+            'pending': self.pending.qsize(),
+            'exported': self.exported,
+            'dropped': self.dropped
+        }
+
+    def _start(self):
+        """start the export thread on first use"""
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+        threading.Thread(target=self._export_loop, name='trace-exporter', daemon=True).start()
+
+    def _export_loop(self):
+        while True:
+            traces = [self.pending.get()]
+            while len(traces) < self.batch_size and not self.pending.empty():
+                traces.append(self.pending.get_nowait())
+            try:
+                self.exporter.export(traces)
+                self.exported += len(traces)
+            except Exception as e:
+                self.dropped += len(traces)
+                print(f'[Tracing] Export Failed | Traces: {len(traces)} | Error: {e}')
+
+
+# shared tracer instance
+compile_tracer = CompileTracer()
@@ -1,18 +1,42 @@
+import json
+import time
+import zlib
 # import Flask
-from flask import request
+from flask import request, current_app
 from flask_login import current_user
 from flask_socketio import emit, disconnect
 from app import socketio
-from app.compiler import TypstRealtimeCompiler
+from app.compiler import TypstRealtimeCompiler, create_backend, ENVIRONMENT_WRAPPERS
+from app.cache import render_cache
+from app.scheduler import compile_scheduler
+from app.precheck import compile_precheck
+from app.executor import compile_executor
+from app.registry import session_registry
+from app.ratelimit import compile_rate_limiter
+from app.debounce import debounce_advisor
+from app.svg import SvgPatcher, GlyphDictionary
+from app.metrics import metrics, COMPILE_SECONDS, COMPILE_PHASE_SECONDS
+from app.tracing import compile_tracer
+from app.workspace import workspace_pool
 
 
 # Store Compilers
 # {session_id: compiler_instance}
 compilers = {}
 
-# Store Users
-# {user_id: set(session_id_1, session_id_2, ...)}
-user_sessions = {}
+# Users and their Sessions live in session_registry, shared by all workers
+
+# Store Compiles held back by the Rate Limiter, the latest of a Session wins
+# {session_id: (seq, job)}
+throttled_compiles = {}
+
+# Store last SVG sent to each Session
+# {session_id: svg_patcher}
+svg_patchers = {}
+
+# Store Glyph Symbols each Session holds
+# {session_id: glyph_dictionary}
+glyph_dictionaries = {}
 
 # SocketIO Runner  
 @socketio.on('connect')
@@ -26,17 +50,20 @@ def handle_connect():
     else:
         user_id = current_user.id
     
-    # build compiler
+    # build compiler, its backend and workspace wait for the first compile
+    config = current_app.config
     compilers[session_id] = TypstRealtimeCompiler(
         user_id=user_id,
-        session_id=session_id
+        session_id=session_id,
+        backend_factory=lambda: create_backend(config)
     )
+    svg_patchers[session_id] = SvgPatcher(
+        min_saving=current_app.config.get('SVG_PATCH_MIN_SAVING', 0.2)
+    )
+    glyph_dictionaries[session_id] = GlyphDictionary()
     
     # add session to User
-    if user_id not in user_sessions:
-        user_sessions[user_id] = set()
-    user_sessions[user_id].add(session_id)
-    active_connections = len(user_sessions[user_id])
+    active_connections = session_registry.add(user_id, session_id)
     
     # emit info
     print(f'[SocketIO] Connect Client | User: "{user_id}" | Session: "{session_id}" | Active Connections: {active_connections}')
@@ -44,7 +71,8 @@ def handle_connect():
         'message': 'Connect to Typst Compiler',
         'user_id': user_id,
         'session_id': session_id,
-        'active_connections': active_connections
+        'active_connections': active_connections,
+        'debounce': debounce_advisor.advise(session_id)
     })
 
 @socketio.on('disconnect')
@@ -56,17 +84,22 @@ def handle_disconnect():
         user_id = compiler.user_id
         
         # clean compilers
+        compile_scheduler.discard_session(user_id, session_id)
+        throttled_compiles.pop(session_id, None)
+        compile_rate_limiter.discard_session(session_id)
+        debounce_advisor.discard_session(session_id)
         compiler.cleanup()
         del compilers[session_id]
+        svg_patchers.pop(session_id, None)
+        glyph_dictionaries.pop(session_id, None)
         
         # clean session in User
-        if user_id in user_sessions:
-            user_sessions[user_id].discard(session_id)
-            if not user_sessions[user_id]:
-                del user_sessions[user_id]
-                print(f'[SocketIO] User "{user_id}" Disconnect All Connections!')
-            else:
-                print(f'[SocketIO] User "{user_id}" Disconnect One Connection | Active Connections: {len(user_sessions[user_id])}')
+        remaining = session_registry.remove(user_id, session_id)
+        if not remaining:
+            compile_rate_limiter.discard_user(user_id)
+            print(f'[SocketIO] User "{user_id}" Disconnect All Connections!')
+        else:
+            print(f'[SocketIO] User "{user_id}" Disconnect One Connection | Active Connections: {remaining}')
         
         # emit info
         print(f'[SocketIO] Disconnect Client | User: "{user_id}" | Session: "{session_id}"')
@@ -74,9 +107,20 @@ def handle_disconnect():
 @socketio.on('compile')
 def handle_compile(data):
     session_id = request.sid
+    received = time.perf_counter()
     
     try:
         typst_code = data.get('code', '')
+        env = data.get('env')
+        delivery = delivery_options(data)
+        
+        # check environment
+        if env is not None and env not in ENVIRONMENT_WRAPPERS:
+            emit('compile_result', {
+                'success': False,
+                'error': f'Unknown Environment: {env}'
+            })
+            return None
         
         # check empty Typst Code
         if not typst_code.strip():
@@ -95,11 +139,40 @@ def handle_compile(data):
             })
             return None
         
-        # compile the Typst Code
-        result = compiler.compile_to_svg(typst_code)
+        # sequence number: only the latest request of a session matters
+        seq = data.get('seq')
+        if not isinstance(seq, int):
+            seq = compiler.latest_seq + 1
+        
+        # sampled compiles record a span tree
+        trace = compile_tracer.start(
+            'compile',
+            compiler.user_id,
+            session_id=session_id,
+            seq=seq,
+            env=env or 'passage',
+            code_bytes=len(typst_code)
+        )
         
-        # emit result
-        emit('compile_result', result)
+        def supersede():
+            """ the new request is held or queued: older results are stale, the running compile stops """
+            compiler.latest_seq = seq
+            compiler.cancel()
+        
+        with compile_tracer.activate(trace), compile_tracer.span('handle_compile'):
+            # over the rate limit: hold the request back instead of failing it
+            job = lambda: run_compile(compiler, session_id, typst_code, env, seq, delivery, received, trace)
+            wait = compile_rate_limiter.acquire(compiler.user_id, session_id)
+            if wait:
+                compile_tracer.annotate(throttled_seconds=round(wait, 3))
+                supersede()
+                hold_compile(compiler, session_id, seq, job, wait)
+                accepted = True
+            else:
+                # a rejected request leaves the running compile alone
+                accepted = submit_compile(compiler, session_id, seq, job, on_accept=supersede)
+        if trace and not accepted:
+            trace.finish(outcome='rejected')
         
     except Exception as e:
         print(f'[SocketIO] Compile Error: {e}')
@@ -108,6 +181,148 @@ def handle_compile(data):
             'error': f'Server Processing Error: {str(e)}'
         })
 
+def submit_compile(compiler, session_id, seq, job, on_accept=None):
+    """ Queue the Typst Code, replacing queued requests of this session """
+    accepted = compile_scheduler.submit(compiler.user_id, session_id, job, coalesce=True, on_accept=on_accept)
+    if not accepted:
+        socketio.emit('compile_result', {
+            'success': False,
+            'error': 'Too Many Pending Compiles, Please Slow Down!',
+            'seq': seq
+        }, to=session_id)
+    return accepted
+
+def hold_compile(compiler, session_id, seq, job, wait):
+    """ Hold a throttled Compile until the buckets refill, newer requests replace it """
+    merged = session_id in throttled_compiles
+    throttled_compiles[session_id] = (seq, job)
+    compile_rate_limiter.count_held(merged)
+    if merged:
+        return
+    debounce = compile_rate_limiter.suggested_debounce()
+    debounce_advisor.set_floor(session_id, debounce)
+    emit('throttled', {
+        'retry_after': round(wait, 3),
+        'debounce': debounce
+    })
+    socketio.start_background_task(run_held_compile, compiler, session_id, wait)
+
+def run_held_compile(compiler, session_id, wait):
+    """ Submit the held Compile of a Session once a token is available """
+    while wait:
+        socketio.sleep(wait)
+        if compilers.get(session_id) is not compiler:
+            return
+        wait = compile_rate_limiter.acquire(compiler.user_id, session_id)
+    held = throttled_compiles.pop(session_id, None)
+    if held:
+        seq, job = held
+        submit_compile(compiler, session_id, seq, job)
+
+def delivery_options(data):
+    """ How the Client wants Results delivered, read in the App Context """
+    return {
+        # client applies svg patches
+        'patch': bool(data.get('patch')),
+        # client keeps glyph symbols between compiles
+        'glyphs': bool(data.get('glyphs')),
+        # client inflates compressed results
+        'encoding': data.get('encoding'),
+        'compress_min_bytes': current_app.config.get('COMPILE_RESULT_COMPRESS_MIN_BYTES', 1024),
+        'compress_level': current_app.config.get('COMPILE_RESULT_COMPRESS_LEVEL', 6),
+        # svg optimizer level of the live editor
+        'optimize': current_app.config.get('SVG_OPTIMIZE_EDITOR', 'aggressive'),
+        'precision': current_app.config.get('SVG_OPTIMIZE_PRECISION', 2)
+    }
+
+def run_compile(compiler, session_id, typst_code, env, seq, delivery, received, trace=None):
+    """ Compile on a Scheduler Worker and emit to the Session """
+    with compile_tracer.activate(trace):
+        outcome = traced_compile(compiler, session_id, typst_code, env, seq, delivery, received)
+    if trace:
+        trace.finish(outcome=outcome)
+
+def traced_compile(compiler, session_id, typst_code, env, seq, delivery, received):
+    """ Compile and emit under the current Trace, return the outcome """
+    # session closed or request superseded while queued
+    started = time.perf_counter()
+    COMPILE_PHASE_SECONDS.observe(started - received, 'queue')
+    compile_tracer.record('queue', started - received)
+    if compilers.get(session_id) is not compiler or seq != compiler.latest_seq:
+        return 'superseded'
+    
+    # compile the Typst Code, off the event loop
+    with compile_tracer.span('compile_to_svg'):
+        result = compile_executor.run(
+            compile_tracer.wrap(compiler.compile_to_svg),
+            typst_code,
+            env,
+            optimize=delivery['optimize'],
+            precision=delivery['precision']
+        )
+    
+    # emit result, only if still the latest
+    if result.get('cancelled') or seq != compiler.latest_seq:
+        return 'superseded'
+    result['seq'] = seq
+    
+    # advertise a new debounce when this document or the server load changed it
+    compiled = time.perf_counter()
+    if not result.get('incomplete'):
+        debounce_advisor.record(session_id, compiled - started)
+    outcome = 'success' if result['success'] else 'incomplete' if result.get('incomplete') else 'error'
+    with compile_tracer.phase('emit'):
+        debounce = debounce_advisor.advise(session_id)
+        if debounce is not None:
+            result['debounce'] = debounce
+        
+        # send only what changed since the last SVG of this session
+        patcher = svg_patchers.get(session_id)
+        if delivery['patch'] and patcher and result['success']:
+            result.update(patcher.encode(result.pop('svg')))
+        # and only glyphs the session has not seen
+        glyph_dictionary = glyph_dictionaries.get(session_id)
+        if delivery['glyphs'] and glyph_dictionary and result['success']:
+            glyph_dictionary.apply(result)
+        socketio.emit('compile_result', compress_result(result, delivery), to=session_id)
+    COMPILE_SECONDS.observe(time.perf_counter() - received, outcome)
+    return outcome
+
+def compress_result(result, delivery):
+    """ Replace large svg / patch fields with deflate-compressed binary attachments """
+    if delivery['encoding'] != 'deflate':
+        return result
+    min_bytes, level = delivery['compress_min_bytes'], delivery['compress_level']
+    if len(result.get('svg') or '') >= min_bytes:
+        result['svg_deflate'] = zlib.compress(result.pop('svg').encode('utf-8'), level)
+    if result.get('patch'):
+        patch_json = json.dumps(result['patch'], separators=(',', ':'))
+        if len(patch_json) >= min_bytes:
+            result.pop('patch')
+            result['patch_deflate'] = zlib.compress(patch_json.encode('utf-8'), level)
+    return result
+
+@socketio.on('svg_resync')
+def handle_svg_resync(data=None):
+    """ Client could not apply a Patch or misses Glyphs, send the full SVG """
+    session_id = request.sid
+    data = data or {}
+    delivery = delivery_options(data)
+    compiler = compilers.get(session_id)
+    patcher = svg_patchers.get(session_id)
+    glyph_dictionary = glyph_dictionaries.get(session_id)
+    payload = patcher.resync() if patcher else None
+    if compiler and payload:
+        payload.update({
+            'success': True,
+            'seq': compiler.latest_seq
+        })
+        if delivery['glyphs'] and glyph_dictionary:
+            if data.get('reset_glyphs'):
+                glyph_dictionary.reset()
+            glyph_dictionary.apply(payload)
+        emit('compile_result', compress_result(payload, delivery))
+
 @socketio.on('ping')
 def handle_ping():
     session_id = request.sid
@@ -127,12 +342,52 @@ def handle_stats():
     if compiler:
         user_id = compiler.user_id
         compile_count = compiler.compile_count
-        active_connections = len(user_sessions.get(user_id, []))
-        total_users = len(user_sessions)
+        # reaps dead workers first, so the counts below are current
+        cluster = session_registry.cluster_stats()
+        active_connections = session_registry.user_connections(user_id)
+        total_users = session_registry.total_users()
         emit('stats', {
             'user_id': user_id,
             'session_id': session_id,
             'compile_count': compile_count,
             'active_connections': active_connections,
-            'total_users': total_users
-        })
\ No newline at end of file
+            'total_users': total_users,
+            'render_cache': render_cache.stats(),
+            'scheduler': compile_scheduler.stats(),
+            'precheck': compile_precheck.stats(),
+            'rate_limit': compile_rate_limiter.stats(),
+            'glyphs': glyph_dictionaries[session_id].stats() if session_id in glyph_dictionaries else None,
+            'cluster': cluster
+        })
+
+def worker_stats():
+    """ Stats of this Worker, summed across Workers by the Session Registry """
+    cache_stats = render_cache.stats()
+    scheduler_stats = compile_scheduler.stats()
+    return {
+        'sessions': len(compilers),
+        'compile_count': sum(compiler.compile_count for compiler in list(compilers.values())),
+        'running': scheduler_stats['running'],
+        'queued': scheduler_stats['queued'],
+        'cache_hits': cache_stats['hits'],
+        'cache_misses': cache_stats['misses'],
+        'precheck_skipped': compile_precheck.stats()['skipped']
+    }
+
+session_registry.stats_provider = worker_stats
+# Worker Gauges and Counters, read on each /metrics scrape
+metrics.gauge('typstlive_active_sockets', 'Connected editor sockets of this worker', lambda: len(compilers))
+metrics.gauge('typstlive_compile_queue_depth', 'Compiles waiting for a scheduler worker', lambda: compile_scheduler.stats()['queued'])
+metrics.gauge('typstlive_compile_running', 'Compiles running on scheduler workers', lambda: compile_scheduler.stats()['running'])
+metrics.gauge('typstlive_compile_throttled', 'Compiles held back by the rate limiter', lambda: len(throttled_compiles))
+metrics.counter('typstlive_compile_rejected', 'Compiles rejected by a full scheduler queue', callback=lambda: compile_scheduler.stats()['rejected'])
+metrics.counter('typstlive_render_cache_lookups', 'Render cache lookups by result', callback=lambda: {
+    ('hit',): render_cache.stats()['hits'],
+    ('miss',): render_cache.stats()['misses']
+}, labels=('result',))
+metrics.gauge('typstlive_render_cache_hit_ratio', 'Render cache hits per lookup', lambda: render_cache.stats()['hit_ratio'])
+metrics.gauge('typstlive_render_cache_bytes', 'Size of the in-memory render cache', lambda: render_cache.stats()['bytes'])
+metrics.gauge('typstlive_workspaces_idle', 'Emptied temp workspaces waiting for a compiler', lambda: workspace_pool.stats()['idle'])
+metrics.counter('typstlive_workspaces_created', 'Temp workspaces created with mkdtemp', callback=lambda: workspace_pool.stats()['created'])
+metrics.counter('typstlive_traces_exported', 'Sampled compile traces exported', callback=lambda: compile_tracer.stats()['exported'])
+metrics.counter('typstlive_traces_dropped', 'Sampled compile traces dropped by a full or failing exporter', callback=lambda: compile_tracer.stats()['dropped'])
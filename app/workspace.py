@@ -0,0 +1,102 @@
+import os
+import atexit
+import shutil
+import tempfile
+import threading
+
+
+class WorkspacePool:
+    """Pool of Temp Workspaces, recycled between Compilers instead of mkdtemp / rmtree"""
+    def __init__(self, workspace_dir=None, max_idle=64):
+        self.workspace_dir = workspace_dir
+        self.max_idle = max_idle
+        self.lock = threading.Lock()
+        self.idle = []
+        self.exit_registered = False
+        # counters
+        self.created = 0
+        self.reused = 0
+        self.removed = 0
+
+    def init_app(self, app):
+        """read workspace config, pre-create workspaces when the backend uses them"""
+        self.workspace_dir = app.config.get('TYPST_WORKSPACE_DIR', self.workspace_dir)
+        self.max_idle = app.config.get('TYPST_WORKSPACE_POOL_SIZE', self.max_idle)
+        uses_workspaces = app.config.get('TYPST_BACKEND') == 'watch' or app.config.get('TYPST_COMPILE_IO') == 'file'
+        if uses_workspaces:
+            self.prewarm(app.config.get('TYPST_WORKSPACE_POOL_PREWARM', 0))
+
+    def prewarm(self, count):
+        with self.lock:
+            missing = min(count, self.max_idle) - len(self.idle)
+        for _ in range(missing):
+            self.release(self._create())
+
+    def acquire(self):
+        """an empty workspace directory"""
+        with self.lock:
+            if self.idle:
+                self.reused += 1
+                return self.idle.pop()
+        return self._create()
+
+    def release(self, path):
+        """empty the workspace and keep it, or remove it above the ceiling"""
+        with self.lock:
+            keep = len(self.idle) < self.max_idle
+        if keep:
+            try:
+                self._empty(path)
+            except OSError as e:
+                print(f'[Workspace] Recycle Failed | Workspace: "{path}" | Error: {e}')
+                keep = False
+        if not keep:
+            self._remove(path)
+            return
+        with self.lock:
+            self.idle.append(path)
+
+    def clear(self):
+        """remove idle workspaces"""
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for path in idle:
+            self._remove(path)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'idle': len(self.idle),
+                'created': self.created,
+                'reused': self.reused,
+                'removed': self.removed
+            }
+
+    def _create(self):
+        path = tempfile.mkdtemp(prefix='typstlive-', dir=self.workspace_dir)
+        with self.lock:
+            self.created += 1
+            # idle workspaces do not outlive the process
+            if not self.exit_registered:
+                self.exit_registered = True
+                atexit.register(self.clear)
+        return path
+
+    def _remove(self, path):
+        shutil.rmtree(path, ignore_errors=True)
+        with self.lock:
+            self.removed += 1
+
+    @staticmethod
+    def _empty(path):
+        """cleanup step: drop sources, outputs and partial writes of the last compiler"""
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path)
+                else:
+                    os.unlink(entry.path)
+
+
+# shared workspace pool instance
+workspace_pool = WorkspacePool()
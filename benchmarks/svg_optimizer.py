@@ -0,0 +1,68 @@
+"""
+Benchmark of optimize_svg on real Typst output
+
+    python benchmarks/svg_optimizer.py [file.svg ...]
+
+without files a sample document is compiled with the typst CLI
+"""
+import os
+import sys
+import time
+import subprocess
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.svg import optimize_svg  # noqa: E402
+
+SAMPLE = r"""
+#set page(width: auto, height: auto, margin: 20pt)
+#set text(size: 24pt)
+= Sample
+Hello *world*, see #link("https://typst.app/docs/v0.12.0")[the docs].
+$ sum_(i=1)^n i^2 = (n(n+1)(2n+1)) / 6 $
+$ integral_0^infinity e^(-x^2) dif x = sqrt(pi) / 2 $
+#table(columns: 3, [a], [b], [c], [1.25], [2.5], [3.75])
+#box(stroke: red, inset: 3pt)[boxed] #rect(fill: rgb("#aabbcc"), width: 2cm)
+"""
+
+
+def compile_sample(copies=20):
+    with tempfile.TemporaryDirectory() as workspace:
+        source = os.path.join(workspace, 'sample.typ')
+        output = os.path.join(workspace, 'sample.svg')
+        with open(source, 'w', encoding='utf-8') as f:
+            f.write(SAMPLE * copies)
+        subprocess.run(['typst', 'compile', source, output, '--format', 'svg'], check=True)
+        with open(output, 'r', encoding='utf-8') as f:
+            return 'sample', f.read()
+
+
+def bench(svg, level, rounds):
+    optimize_svg(svg, level)
+    started = time.perf_counter()
+    for _ in range(rounds):
+        optimize_svg(svg, level)
+    return (time.perf_counter() - started) / rounds
+
+
+def main(paths):
+    documents = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            documents.append((os.path.basename(path), f.read()))
+    if not documents:
+        documents.append(compile_sample())
+
+    print(f"{'document':<20} {'level':<11} {'bytes':>9} {'out':>9} {'saved':>7} {'ms':>8} {'MB/s':>7}")
+    for name, svg in documents:
+        rounds = max(5, int(2e7 / max(len(svg), 1)))
+        for level in ('lossless', 'aggressive'):
+            seconds = bench(svg, level, rounds)
+            size = len(optimize_svg(svg, level))
+            print(f"{name:<20} {level:<11} {len(svg):>9} {size:>9} {1 - size / len(svg):>7.1%} "
+                  f"{seconds * 1e3:>8.3f} {len(svg) / seconds / 1e6:>7.1f}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,44 @@
+from flask import Flask
+from app.config import Config
+from app.cache import render_cache
+from app.workspace import workspace_pool
+from app.compiler import TypstRealtimeCompiler, create_backend
+from app.service import CompileService
+
+
+def main():
+    # config only: the service has no routes or database
+    app = Flask(__name__)
+    app.config.from_object(Config)
+
+    # the service compiles itself, never through another service
+    backend_name = app.config.get('COMPILE_SERVICE_BACKEND', 'watch')
+    if backend_name == 'service':
+        backend_name = 'watch'
+    # cache keys and workspaces follow the backend the service compiles with
+    app.config['TYPST_BACKEND'] = backend_name
+    render_cache.init_app(app)
+    workspace_pool.init_app(app)
+
+    service = CompileService(
+        socket_path=app.config.get('COMPILE_SERVICE_SOCKET'),
+        compiler_factory=lambda: TypstRealtimeCompiler(
+            session_id='compile-service',
+            backend=create_backend(app.config, backend_name)
+        ),
+        workers=app.config.get('COMPILE_SERVICE_WORKERS')
+    )
+
+    # print info
+    print("Hello from TypstLive Compile Service!")
+    print(f"Socket: {service.socket_path}")
+    print(f"Backend: {backend_name} | Workers: {service.workers}")
+
+    service.serve_forever()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\n\n[Compile Service] Service stopped by user. Goodbye!")
@@ -1,4 +1,14 @@
 import os
+
+# gevent patches subprocess, threads and sockets before anything imports them, for
+#   cooperative compiles: not for the engine backend, multiprocessing pipes break once patched
+#   the message queue and the session registry: their redis clients block on plain sockets
+cooperative = os.environ.get('COMPILE_EXECUTION') == 'cooperative' and os.environ.get('TYPST_BACKEND') != 'engine'
+redis_clients = os.environ.get('SOCKETIO_MESSAGE_QUEUE') or os.environ.get('SESSION_REGISTRY_URL')
+if cooperative or redis_clients:
+    from gevent import monkey
+    monkey.patch_all()
+
 from app import create_app, db, socketio
 from app.models import User, CompilationHistory
 
@@ -15,6 +25,17 @@ def make_shell_context():
     }
 
 
+@app.cli.command("dedup-favorites")
+def dedup_favorites():
+    """Backfill content hashes and merge duplicate favorites (one-off)."""
+    from app.repository import history_repository
+    from app.routes import release_artifact
+    hashed, removed = history_repository.deduplicate()
+    for _, artifact_hash, output_format in removed:
+        release_artifact(artifact_hash, output_format)
+    print(f"[Favorites] Dedup Done | Hashed: {hashed} | Removed: {len(removed)}")
+
+
 def main():
     # GET HOST and PORT
     host = os.environ.get("FLASK_HOST", "127.0.0.1")
@@ -0,0 +1,50 @@
+"""add full-text search to compilation_history
+
+Revision ID: e8f4a2c7b913
+Revises: d5a8e3b1c6f7
+Create Date: 2026-10-18 11:41:09.352716
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8f4a2c7b913'
+down_revision = 'd5a8e3b1c6f7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'mysql':
+        op.create_index('ix_compilation_history_typst_code_fulltext', 'compilation_history', ['typst_code'], unique=False, mysql_prefix='FULLTEXT')
+    elif dialect == 'sqlite':
+        # external-content FTS5 table, kept in sync by triggers
+        op.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS compilation_history_fts USING fts5(
+            typst_code, content='compilation_history', content_rowid='id', prefix='2 3'
+        )""")
+        op.execute("""CREATE TRIGGER IF NOT EXISTS compilation_history_fts_insert AFTER INSERT ON compilation_history BEGIN
+            INSERT INTO compilation_history_fts(rowid, typst_code) VALUES (new.id, new.typst_code);
+        END""")
+        op.execute("""CREATE TRIGGER IF NOT EXISTS compilation_history_fts_delete AFTER DELETE ON compilation_history BEGIN
+            INSERT INTO compilation_history_fts(compilation_history_fts, rowid, typst_code) VALUES ('delete', old.id, old.typst_code);
+        END""")
+        op.execute("""CREATE TRIGGER IF NOT EXISTS compilation_history_fts_update AFTER UPDATE OF typst_code ON compilation_history BEGIN
+            INSERT INTO compilation_history_fts(compilation_history_fts, rowid, typst_code) VALUES ('delete', old.id, old.typst_code);
+            INSERT INTO compilation_history_fts(rowid, typst_code) VALUES (new.id, new.typst_code);
+        END""")
+        # index the existing rows
+        op.execute("INSERT INTO compilation_history_fts(compilation_history_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'mysql':
+        op.drop_index('ix_compilation_history_typst_code_fulltext', table_name='compilation_history')
+    elif dialect == 'sqlite':
+        op.execute("DROP TRIGGER IF EXISTS compilation_history_fts_update")
+        op.execute("DROP TRIGGER IF EXISTS compilation_history_fts_delete")
+        op.execute("DROP TRIGGER IF EXISTS compilation_history_fts_insert")
+        op.execute("DROP TABLE IF EXISTS compilation_history_fts")
@@ -0,0 +1,139 @@
+import sys
+import textwrap
+import threading
+import socketserver
+
+import pytest
+
+# stand-in for the typst CLI: `sleep:<seconds>` in the source delays the
+# compile, `error` fails it, anything else renders a one-line SVG,
+# `typst watch` recompiles on every write and reports on stderr
+FAKE_TYPST = '''\
+import os, re, sys, time
+
+def render(source, output_path):
+    delay = re.search(r'sleep:([0-9.]+)', source)
+    if delay:
+        time.sleep(float(delay.group(1)))
+    if 'error' in source:
+        return False
+    svg = '<svg xmlns="http://www.w3.org/2000/svg"><text>%d</text></svg>' % len(source)
+    if output_path == '-':
+        sys.stdout.write(svg)
+    else:
+        open(output_path, 'w', encoding='utf-8').write(svg)
+    return True
+
+args = sys.argv[1:]
+source_path, output_path = args[1], args[2]
+if args[0] == 'watch':
+    seen = None
+    while True:
+        stat = os.stat(source_path)
+        if (stat.st_ino, stat.st_mtime_ns) != seen:
+            seen = (stat.st_ino, stat.st_mtime_ns)
+            if render(open(source_path, encoding='utf-8').read(), output_path):
+                sys.stderr.write('compiled successfully\\n')
+            else:
+                sys.stderr.write('compiled with errors\\nerror: unexpected error\\n')
+            sys.stderr.flush()
+        time.sleep(0.01)
+source = sys.stdin.read() if source_path == '-' else open(source_path, encoding='utf-8').read()
+if not render(source, output_path):
+    sys.stderr.write('error: unexpected error\\n')
+    sys.exit(1)
+'''
+
+
+@pytest.fixture
+def fake_typst(tmp_path):
+    """path of an executable fake `typst`"""
+    path = tmp_path / 'typst'
+    path.write_text(f'#!{sys.executable}\n' + textwrap.dedent(FAKE_TYPST), encoding='utf-8')
+    path.chmod(0o755)
+    return str(path)
+
+
+class RespStandIn(socketserver.ThreadingTCPServer):
+    """
+    In-process stand-in of a Redis-protocol server, the hash and set
+    commands the session registry uses
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), RespHandler)
+        self.lock = threading.Lock()
+        self.data = {}
+
+    @property
+    def url(self):
+        return f'redis://127.0.0.1:{self.server_address[1]}/0'
+
+    def execute(self, command, *args):
+        with self.lock:
+            if command in ('AUTH', 'SELECT'):
+                return 'OK'
+            if command == 'DEL':
+                return sum(self.data.pop(key, None) is not None for key in args)
+            key, args = args[0], args[1:]
+            value = self.data.setdefault(key, {} if command.startswith('H') else set())
+            if command == 'HSET':
+                reply = sum(field not in value for field in args[::2])
+                value.update(zip(args[::2], args[1::2]))
+            elif command == 'HDEL':
+                reply = sum(value.pop(field, None) is not None for field in args)
+            elif command == 'HGETALL':
+                reply = [item for pair in value.items() for item in pair]
+            elif command == 'SADD':
+                reply = len(set(args) - value)
+                value.update(args)
+            elif command == 'SREM':
+                reply = len(set(args) & value)
+                value.difference_update(args)
+            elif command == 'SMEMBERS':
+                reply = sorted(value)
+            elif command in ('HLEN', 'SCARD'):
+                reply = len(value)
+            else:
+                reply = RuntimeError(f'unknown command {command}')
+            # empty keys do not exist
+            if not value:
+                del self.data[key]
+            return reply
+
+
+class RespHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = []
+            for _ in range(int(line[1:])):
+                length = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(length + 2)[:-2].decode('utf-8'))
+            self.wfile.write(self.encode(self.server.execute(args[0].upper(), *args[1:])))
+
+    def encode(self, reply):
+        if isinstance(reply, Exception):
+            return f'-ERR {reply}\r\n'.encode()
+        if isinstance(reply, int):
+            return f':{reply}\r\n'.encode()
+        if isinstance(reply, list):
+            return f'*{len(reply)}\r\n'.encode() + b''.join(self.encode(item) for item in reply)
+        if reply == 'OK':
+            return b'+OK\r\n'
+        data = reply.encode('utf-8')
+        return f'${len(data)}\r\n'.encode() + data + b'\r\n'
+
+
+@pytest.fixture
+def resp_server():
+    """url of a fresh Redis-protocol stand-in"""
+    server = RespStandIn()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,124 @@
+import os
+import signal
+import threading
+import time
+
+import pytest
+
+from app.backends import CliBackend, CompileCancelled, WatchBackend
+from app.cache import render_cache
+from app.compiler import TypstRealtimeCompiler, build_source
+from app.workspace import workspace_pool
+
+
+def wait_for_run(backend, timeout=5):
+    """block until the backend has a typst child running"""
+    deadline = time.monotonic() + timeout
+    while not backend.runs:
+        assert time.monotonic() < deadline, 'typst child did not start'
+        time.sleep(0.01)
+    return next(iter(backend.runs))
+
+
+def compile_in_thread(compiler, code):
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(compiler.compile_to_svg(code)))
+    thread.start()
+    return thread, result
+
+
+@pytest.mark.parametrize('io_mode', ['file', 'pipe'])
+def test_cancel_then_compile(fake_typst, io_mode):
+    """a superseded compile is cancelled even when the next one starts right away"""
+    backend = CliBackend(typst_path=fake_typst, timeout=10, io_mode=io_mode)
+    compiler = TypstRealtimeCompiler(backend=backend)
+    slow_code = f'sleep:3 cancel-then-compile {io_mode}'
+    try:
+        slow, slow_result = compile_in_thread(compiler, slow_code)
+        wait_for_run(backend)
+        compiler.cancel()
+        fast, fast_result = compile_in_thread(compiler, f'fast {io_mode}')
+        slow.join(5)
+        fast.join(5)
+
+        assert slow_result.get('cancelled') is True
+        assert fast_result['success'] is True
+        # a killed compile says nothing about the source
+        assert render_cache.get(render_cache.make_key(build_source(slow_code))) is None
+    finally:
+        compiler.cleanup()
+
+
+def test_killed_child_is_not_cached(fake_typst):
+    """a typst child killed from outside is not taken for a compile error"""
+    backend = CliBackend(typst_path=fake_typst, timeout=10, io_mode='pipe')
+    compiler = TypstRealtimeCompiler(backend=backend)
+    code = 'sleep:3 killed from outside'
+    try:
+        thread, result = compile_in_thread(compiler, code)
+        os.kill(wait_for_run(backend).process.pid, signal.SIGKILL)
+        thread.join(5)
+
+        assert result.get('cancelled') is True
+        assert render_cache.get(render_cache.make_key(build_source(code))) is None
+    finally:
+        compiler.cleanup()
+
+
+def test_compile_errors_are_reported(fake_typst):
+    backend = CliBackend(typst_path=fake_typst, timeout=10, io_mode='file')
+    with TypstRealtimeCompiler(backend=backend) as compiler:
+        result = compiler.compile_to_svg('error in source')
+    assert result['success'] is False
+    assert 'unexpected error' in result['error']
+
+
+def make_backend(kind, typst_path):
+    if kind == 'watch':
+        return WatchBackend(typst_path=typst_path, timeout=10, cancel_grace=3)
+    return CliBackend(typst_path=typst_path, timeout=10, io_mode=kind)
+
+
+@pytest.mark.parametrize('kind', ['file', 'pipe', 'watch'])
+def test_compile_after_cleanup(fake_typst, kind):
+    backend = make_backend(kind, fake_typst)
+    backend.cleanup()
+    with pytest.raises(CompileCancelled):
+        backend.compile('after cleanup')
+    assert backend.temp_dir is None
+
+
+@pytest.mark.parametrize('kind', ['file', 'watch'])
+def test_cleanup_during_compile_leaves_recycled_workspace_alone(fake_typst, kind):
+    """a compile caught by the disconnect never restarts or writes into the next owner's workspace"""
+    backend = make_backend(kind, fake_typst)
+    workspace = backend.temp_dir
+    results = []
+
+    def compile_one(code):
+        try:
+            results.append(backend.compile(code))
+        except CompileCancelled:
+            results.append('cancelled')
+
+    slow = threading.Thread(target=compile_one, args=('sleep:2 superseded',))
+    slow.start()
+    time.sleep(0.5)
+    # superseded: the next compile waits for the slow one
+    backend.cancel()
+    slow.join(5)
+    waiting = threading.Thread(target=compile_one, args=('sleep:2 next compile',))
+    waiting.start()
+    time.sleep(0.2)
+
+    backend.cleanup()
+    reused = workspace_pool.acquire()
+    try:
+        waiting.join(5)
+        assert results == ['cancelled', 'cancelled']
+        assert reused == workspace
+        time.sleep(0.3)
+        assert os.listdir(reused) == []
+        assert not backend.is_alive() if kind == 'watch' else not backend.runs
+    finally:
+        workspace_pool.release(reused)
@@ -0,0 +1,54 @@
+from flask import Flask
+
+from app.cache import RenderCache
+
+
+def make_cache(disk_dir, disk_max_bytes=1024 * 1024, salt=None):
+    app = Flask(__name__)
+    app.config.update(
+        RENDER_CACHE_DIR=str(disk_dir),
+        RENDER_CACHE_DIR_MAX_BYTES=disk_max_bytes,
+        RENDER_CACHE_SALT=salt,
+        TYPST_COMPILER_PATH='typst'
+    )
+    cache = RenderCache()
+    cache.init_app(app)
+    return cache
+
+
+def test_disk_tier_evicts_least_recently_used(tmp_path):
+    cache = make_cache(tmp_path, disk_max_bytes=3000)
+    keys = [cache.make_key(f'= Doc {index}') for index in range(3)]
+    for key in keys[:2]:
+        cache.put(key, True, 'x' * 1000)
+    # a read keeps the first entry, the second is the oldest now
+    cache.clear()
+    assert cache.get(keys[0]) is not None
+    cache.put(keys[2], True, 'x' * 1000)
+
+    cache.clear()
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None and cache.get(keys[2]) is not None
+    assert cache.stats()['disk_bytes'] <= 3000
+    assert cache.stats()['disk_evictions'] == 1
+
+
+def test_restart_trims_disk_tier(tmp_path):
+    cache = make_cache(tmp_path)
+    for index in range(4):
+        cache.put(cache.make_key(f'= Doc {index}'), True, 'x' * 1000)
+
+    restarted = make_cache(tmp_path, disk_max_bytes=2500)
+    assert restarted.stats()['disk_entries'] == 2
+    assert len(list(tmp_path.glob('*/*.json'))) == 2
+
+
+def test_key_changes_with_versions(tmp_path):
+    """entries written before an upgrade are not served after it"""
+    cache = make_cache(tmp_path)
+    key = cache.make_key('= Doc')
+    cache.put(key, True, '<svg/>')
+
+    upgraded = make_cache(tmp_path, salt='after-upgrade')
+    assert upgraded.make_key('= Doc') != key
+    assert upgraded.get(upgraded.make_key('= Doc')) is None
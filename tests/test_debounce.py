@@ -0,0 +1,51 @@
+from app.debounce import DebounceAdvisor
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_advisor():
+    clock = FakeClock()
+    return DebounceAdvisor(floor_half_life=10.0, clock=clock), clock
+
+
+def test_throttle_floor_comes_back_down():
+    advisor, clock = make_advisor()
+    advisor.record('s1', 0.01)
+    assert advisor.recommend('s1') == 0
+
+    advisor.set_floor('s1', 800)
+    assert advisor.recommend('s1') == 800
+    clock.now += 10
+    assert advisor.recommend('s1') == 400
+    clock.now += 10
+    assert advisor.recommend('s1') == 200
+    # load is gone: back to the session's own debounce
+    clock.now += 120
+    assert advisor.recommend('s1') == 0
+    assert 's1' not in advisor.floors
+
+
+def test_throttling_again_restarts_the_decay():
+    advisor, clock = make_advisor()
+    advisor.set_floor('s1', 800)
+    clock.now += 10
+    advisor.set_floor('s1', 300)
+    # the higher of the decayed floor and the new one
+    assert advisor.recommend('s1') == 400
+    clock.now += 10
+    assert advisor.recommend('s1') == 200
+
+
+def test_advise_sends_the_lower_value():
+    advisor, clock = make_advisor()
+    advisor.set_floor('s1', 600)
+    assert advisor.advise('s1') == 600
+    assert advisor.advise('s1') is None
+    clock.now += 60
+    assert advisor.advise('s1') == 0
@@ -0,0 +1,89 @@
+import sys
+import time
+import subprocess
+
+import gevent
+from flask import Flask
+from flask_socketio import SocketIO
+
+from app.backends import CliBackend
+from app.executor import CompileExecutor
+
+COMPILES = 10
+COMPILE_SECONDS = 1.0
+# far below the 25 s ping interval, a stalled hub misses it by whole compiles
+MAX_HEARTBEAT_GAP = 0.5
+
+
+def make_executor(strategy):
+    """executor paired with a gevent SocketIO server, no monkey patching"""
+    app = Flask(__name__)
+    app.config.update(COMPILE_EXECUTION=strategy, COMPILE_WORKERS=COMPILES)
+    socketio = SocketIO(app, async_mode='gevent')
+    executor = CompileExecutor()
+    executor.init_app(app, socketio)
+    return executor
+
+
+def run_compiles(executor, typst_path, count):
+    """start count slow compiles as greenlets, return the longest gap between heartbeats"""
+    gaps = []
+    running = True
+
+    def heartbeat():
+        last = time.perf_counter()
+        while running:
+            gevent.sleep(0.02)
+            now = time.perf_counter()
+            gaps.append(now - last)
+            last = now
+
+    def compile_one(index):
+        backend = CliBackend(typst_path=typst_path, timeout=10, io_mode='pipe')
+        return executor.run(backend.compile, f'sleep:{COMPILE_SECONDS} #{index}')
+
+    beat = gevent.spawn(heartbeat)
+    gevent.sleep(0.05)
+    compiles = [gevent.spawn(compile_one, index) for index in range(count)]
+    gevent.joinall(compiles, raise_error=True)
+    running = False
+    beat.join()
+    assert all(job.value[0] for job in compiles)
+    return max(gaps)
+
+
+def test_threadpool_keeps_heartbeats_flowing(fake_typst):
+    executor = make_executor('threadpool')
+    assert executor.strategy == 'threadpool'
+    started = time.perf_counter()
+    assert run_compiles(executor, fake_typst, COMPILES) < MAX_HEARTBEAT_GAP
+    # the compiles overlap on the pool threads
+    assert time.perf_counter() - started < COMPILES * COMPILE_SECONDS / 2
+
+
+def test_inline_compiles_stall_the_hub(fake_typst):
+    """the check above can fail: blocking compiles on the hub stop the heartbeats"""
+    executor = make_executor('inline')
+    assert run_compiles(executor, fake_typst, 2) >= COMPILE_SECONDS
+
+
+PATCHED_RUN = """
+from gevent import monkey
+monkey.patch_all()
+import sys
+from tests.test_executor import make_executor, run_compiles
+executor = make_executor('threadpool')
+print(executor.strategy, run_compiles(executor, sys.argv[1], 4))
+"""
+
+
+def test_patched_threadpool_runs_cooperative(fake_typst):
+    """main.py patches for the message queue, compiles then yield by themselves"""
+    result = subprocess.run(
+        [sys.executable, '-c', PATCHED_RUN, fake_typst],
+        capture_output=True, text=True, timeout=60
+    )
+    assert result.returncode == 0, result.stderr
+    strategy, gap = result.stdout.split()[-2:]
+    assert strategy == 'cooperative'
+    assert float(gap) < MAX_HEARTBEAT_GAP
@@ -0,0 +1,19 @@
+from types import SimpleNamespace
+
+from app.routes import claim_history_renders, release_history_renders, rendering_history
+
+
+def test_overlapping_batches_claim_each_favorite_once():
+    first = [SimpleNamespace(id=history_id) for history_id in (1, 2, 3)]
+    second = [SimpleNamespace(id=history_id) for history_id in (3, 4)]
+
+    claimed_first = claim_history_renders(first)
+    claimed_second = claim_history_renders(second)
+    assert [item.id for item in claimed_first] == [1, 2, 3]
+    assert [item.id for item in claimed_second] == [4]
+
+    # released favorites can be claimed again, the others stay with their request
+    release_history_renders(claimed_first)
+    assert [item.id for item in claim_history_renders(first)] == [1, 2, 3]
+    release_history_renders(first + claimed_second)
+    assert not rendering_history
@@ -0,0 +1,31 @@
+from app.metrics import MetricsRegistry
+
+
+def test_observed_counter_is_a_counter():
+    registry = MetricsRegistry()
+    registry.counter('app_rejected', 'Rejected requests', callback=lambda: 3)
+    registry.counter('app_lookups', 'Lookups by result', callback=lambda: {('hit',): 5, ('miss',): 2}, labels=('result',))
+    text = registry.render()
+    assert '# TYPE app_rejected_total counter' in text
+    assert 'app_rejected_total 3' in text
+    assert '# TYPE app_lookups_total counter' in text
+    assert 'app_lookups_total{result="hit"} 5' in text
+    assert 'app_lookups_total{result="miss"} 2' in text
+
+
+def test_counter_keeps_total_suffix_once():
+    registry = MetricsRegistry()
+    results = registry.counter('app_results_total', 'Results by outcome', labels=('outcome',))
+    results.inc('success')
+    results.inc('success')
+    text = registry.render()
+    assert '# TYPE app_results_total counter' in text
+    assert 'app_results_total{outcome="success"} 2' in text
+
+
+def test_gauge_stays_a_gauge():
+    registry = MetricsRegistry()
+    registry.gauge('app_sockets', 'Open sockets', lambda: 4)
+    text = registry.render()
+    assert '# TYPE app_sockets gauge' in text
+    assert 'app_sockets 4' in text
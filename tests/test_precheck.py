@@ -0,0 +1,70 @@
+import shutil
+import subprocess
+
+import pytest
+
+from app.compiler import build_source
+from app.precheck import find_incomplete
+
+TYPST = shutil.which('typst')
+
+# (code, environment) typst compiles, the precheck must let them through
+COMPILES = [
+    ('#let x = 1; Hello [', 'passage'),
+    ('#let x = [a]; [b', 'passage'),
+    ('#show: it => it; [', 'passage'),
+    ('[#let x = 1] after', 'passage'),
+    ('#box[#let x = 1] [', 'passage'),
+    ('$ a #let y = 1; b $', 'passage'),
+    ('#if true [a] else [b]', 'inline-formula'),
+    ('#if true [a] else [b]', 'interline-formula'),
+    ('#for x in (1,2) [#x]', 'inline-formula'),
+    ('#for x in (1,2) [#x]', 'interline-formula'),
+    ('#if true [a] else [b] Hello [', 'passage'),
+    ('#for x in (1,2) [#x] more [', 'passage'),
+    ('#if true {\n[a]\n} else {\n[b]\n}', 'passage'),
+    ('#context text.lang [', 'passage'),
+    ('#let x = $a$', 'passage'),
+    ('https://a.com/$x', 'passage'),
+    ('see https://a.com/#b $x$', 'passage'),
+    ('https://a.com "quote', 'passage'),
+    ('https://a.com/"x"', 'passage'),
+    ('https://a.com/`raw`', 'passage'),
+    ('#link("https://a.com")[x]', 'passage'),
+    ('x^2 + y^2', 'inline-formula'),
+]
+
+# (code, environment, reason) typst cannot compile yet
+INCOMPLETE = [
+    ('$x + ', 'passage', 'Unclosed Formula: missing $'),
+    ('#let x = $a', 'passage', 'Unclosed Formula: missing $'),
+    ('https://a.com/$x$ and $y', 'passage', 'Unclosed Formula: missing $'),
+    ('https://a.com/`raw', 'passage', 'Unclosed Raw Text'),
+    ('#box[a', 'passage', 'Unclosed Delimiter: missing ]'),
+    ('#text(red', 'passage', 'Unclosed Delimiter: missing )'),
+    ('#let s = "abc', 'passage', 'Unclosed String'),
+]
+
+
+def typst_compiles(source):
+    process = subprocess.run(
+        [TYPST, 'compile', '-', '-', '--format', 'svg'],
+        input=source, capture_output=True, text=True, timeout=30
+    )
+    return process.returncode == 0
+
+
+@pytest.mark.parametrize('code, env', COMPILES)
+def test_no_false_positives(code, env):
+    source = build_source(code, env)
+    assert find_incomplete(source) is None
+    if TYPST:
+        assert typst_compiles(source)
+
+
+@pytest.mark.parametrize('code, env, reason', INCOMPLETE)
+def test_incomplete_source(code, env, reason):
+    source = build_source(code, env)
+    assert find_incomplete(source) == reason
+    if TYPST:
+        assert not typst_compiles(source)
@@ -0,0 +1,67 @@
+import time
+
+import pytest
+from flask import Flask
+from flask_socketio import SocketIO
+
+from app.registry import RedisRegistryStore, SessionRegistry
+
+
+def test_add_and_remove_sessions(resp_server):
+    store = RedisRegistryStore(resp_server.url)
+    assert store.add(1, 'a') == 1
+    assert store.add(1, 'b') == 2
+    assert store.add(2, 'c') == 1
+    assert store.total_users() == 2
+
+    assert store.remove(1, 'a') == 1
+    assert store.remove(1, 'b') == 0
+    assert store.user_connections(1) == 0
+    assert store.total_users() == 1
+    # removing a closed session twice is harmless
+    assert store.remove(1, 'b') == 0
+
+
+def test_counts_span_workers(resp_server):
+    first = RedisRegistryStore(resp_server.url)
+    second = RedisRegistryStore(resp_server.url)
+    second.worker_id = 'other-host:1'
+
+    first.add(1, 'a')
+    assert second.add(1, 'b') == 2
+    assert first.user_connections(1) == 2
+
+    first.heartbeat({'running': 1})
+    second.heartbeat({'running': 2})
+    assert sorted(stats['running'] for stats in first.worker_stats_list()) == [1, 2]
+
+    # the user stays listed while the other worker holds a session
+    assert first.remove(1, 'a') == 1
+    assert second.total_users() == 1
+
+
+def test_stale_worker_is_reaped(resp_server):
+    live = RedisRegistryStore(resp_server.url, worker_ttl=0.2)
+    dead = RedisRegistryStore(resp_server.url, worker_ttl=0.2)
+    dead.worker_id = 'dead-host:1'
+
+    live.add(1, 'a')
+    dead.add(1, 'b')
+    dead.add(2, 'c')
+    dead.heartbeat({'running': 1})
+    time.sleep(0.3)
+    live.heartbeat({'running': 0})
+
+    assert live.worker_stats_list() == [{'running': 0}]
+    assert live.user_connections(1) == 1
+    assert live.user_connections(2) == 0
+    assert live.total_users() == 1
+    assert not any(key.endswith('dead-host:1') for key in resp_server.data)
+
+
+def test_registry_requires_monkey_patching_under_gevent(resp_server):
+    """plain sockets would block the gevent hub on every connect"""
+    app = Flask(__name__)
+    app.config.update(SESSION_REGISTRY_URL=resp_server.url)
+    with pytest.raises(RuntimeError, match='monkey patching'):
+        SessionRegistry().init_app(app, SocketIO(app, async_mode='gevent'))
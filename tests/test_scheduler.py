@@ -0,0 +1,48 @@
+import threading
+
+from flask import Flask
+from flask_socketio import SocketIO
+
+from app.scheduler import CompileScheduler
+
+
+def make_scheduler(depth):
+    """one worker, so a blocked job keeps the rest queued"""
+    app = Flask(__name__)
+    app.config.update(COMPILE_WORKERS=1, COMPILE_QUEUE_DEPTH=depth)
+    scheduler = CompileScheduler()
+    scheduler.init_app(app, SocketIO(app, async_mode='threading'))
+    return scheduler
+
+
+def test_rejected_submit_keeps_queue_and_skips_on_accept():
+    scheduler = make_scheduler(depth=1)
+    started, release = threading.Event(), threading.Event()
+    done = []
+
+    def blocking():
+        started.set()
+        release.wait(5)
+
+    assert scheduler.submit(1, 'a', blocking)
+    assert started.wait(5)
+    # another session fills the user's queue
+    assert scheduler.submit(1, 'b', lambda: done.append('b'), coalesce=True)
+
+    accepted = []
+    assert not scheduler.submit(1, 'c', lambda: done.append('c'), coalesce=True, on_accept=lambda: accepted.append('c'))
+    assert accepted == []
+    assert scheduler.stats()['rejected'] == 1
+    assert scheduler.depth() == 1
+
+    # coalescing its own queued job frees the slot, on_accept runs before the job can start
+    order = []
+    assert scheduler.submit(1, 'b', lambda: order.append('job'), coalesce=True, on_accept=lambda: order.append('accept'))
+    assert scheduler.stats()['coalesced'] == 1
+    release.set()
+    for _ in range(100):
+        if order == ['accept', 'job']:
+            break
+        threading.Event().wait(0.05)
+    assert order == ['accept', 'job']
+    assert done == []
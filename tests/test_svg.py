@@ -0,0 +1,74 @@
+from app.svg import optimize_svg
+
+SVG = (
+    '<svg viewBox="0 0 10.123456 20.5" width="10.123456pt" xmlns="http://www.w3.org/2000/svg">\n'
+    '  <!-- comment -->\n'
+    '  <g transform="matrix(1 0 0 1 0 0)" class="c1.23456">\n'
+    '    <path fill="#000000" fill-rule="nonzero" d="M 1.23456 2.5 L -3.98765 4 Z "/>\n'
+    '    <use xlink:href="#g1" x="0" y="1.5"/>\n'
+    '  </g>\n'
+    '  <g transform="matrix(1 0 0 1 5.123456 6)">\n'
+    '    <a xlink:href="https://example.com/v1.23456"><text x="1.23456">Total: 1.23456 <tspan>kg</tspan> <tspan>net</tspan></text></a>\n'
+    '  </g>\n'
+    '  <defs id="glyph">\n'
+    '    <symbol id="g1" overflow="visible"><path d="M 0 0 L 1 1"/></symbol>\n'
+    '    <symbol id="g2" overflow="visible"><path d="M 0 0 L 2 2"/></symbol>\n'
+    '  </defs>\n'
+    '  <defs><symbol id="g3"><path d="M 0 0"/></symbol></defs>\n'
+    '</svg>'
+)
+
+
+def test_lossless():
+    svg = optimize_svg(SVG, 'lossless')
+    assert '<!--' not in svg
+    assert '>\n' not in svg
+    assert 'transform="matrix(1 0 0 1 0 0)"' not in svg
+    assert 'transform="translate(5.123456 6)"' in svg
+    assert ' x="0"' not in svg and 'fill-rule' not in svg
+    assert 'fill="#000"' in svg
+    assert 'd="M1.23456 2.5L-3.98765 4Z"' in svg
+    # unused symbols go, and defs left empty with them
+    assert 'id="g1"' in svg
+    assert 'id="g2"' not in svg and 'id="g3"' not in svg
+    assert svg.count('<defs') == 1
+
+
+def test_lossless_keeps_text_whitespace():
+    svg = optimize_svg(SVG, 'lossless')
+    assert 'Total: 1.23456 <tspan>kg</tspan> <tspan>net</tspan>' in svg
+
+
+def test_evenodd_keeps_nonzero_rule():
+    svg = '<svg><path fill-rule="evenodd" d="M 0 0"/><path fill-rule="nonzero" d="M 0 0"/></svg>'
+    assert 'fill-rule="nonzero"' in optimize_svg(svg, 'lossless')
+
+
+def test_aggressive_rounds_only_geometry():
+    svg = optimize_svg(SVG, 'aggressive', precision=2)
+    assert 'viewBox="0 0 10.12 20.5"' in svg
+    assert 'width="10.12pt"' in svg
+    assert 'd="M1.23 2.5L-3.99 4Z"' in svg
+    assert 'transform="translate(5.12 6)"' in svg
+    assert 'x="1.23"' in svg
+    # links, classes and text are not numbers
+    assert 'xlink:href="https://example.com/v1.23456"' in svg
+    assert 'class="c1.23456"' in svg
+    assert 'Total: 1.23456 ' in svg
+
+
+def test_aggressive_keeps_linear_transform_terms():
+    """#rotate(0.3deg) in typst: cutting the matrix would drop the rotation and shrink the content"""
+    rotated = 'matrix(0.999986292 0.005235964 -0.005235964 0.999986292 201.456789 -0.004)'
+    svg = optimize_svg(f'<svg><g transform="{rotated}"/><g transform="translate(1.126, 2.5)"/></svg>', 'aggressive', precision=2)
+    assert 'transform="matrix(0.999986292 0.005235964 -0.005235964 0.999986292 201.46 0.00)"' in svg
+    assert 'transform="translate(1.13, 2.5)"' in svg
+
+
+def test_aggressive_zero_precision():
+    svg = optimize_svg('<svg><path d="M 1.4 2.6 L 0.9996.7"/></svg>', 'aggressive', precision=0)
+    assert svg == '<svg><path d="M1 3L1 1"/></svg>'
+
+
+def test_no_level_is_untouched():
+    assert optimize_svg(SVG, None) == SVG
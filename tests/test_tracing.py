@@ -0,0 +1,60 @@
+import threading
+
+import gevent
+
+from app.tracing import CompileTracer
+
+
+def make_tracer():
+    """tracer sampling every event, traces are inspected instead of exported"""
+    tracer = CompileTracer()
+    tracer.sample_rate = 1.0
+    tracer.exporter = object()
+    return tracer
+
+
+def stage(tracer, trace, name):
+    """a traced stage that yields to other greenlets in the middle"""
+    with tracer.activate(trace), tracer.span(name):
+        gevent.sleep(0.01)
+        tracer.annotate(owner=name)
+        with tracer.span(f'{name}-inner'):
+            gevent.sleep(0.01)
+        return tracer.current()
+
+
+def test_greenlets_keep_their_own_trace():
+    tracer = make_tracer()
+    first, second = tracer.start('compile', 1), tracer.start('compile', 2)
+    jobs = [gevent.spawn(stage, tracer, first, 'a'), gevent.spawn(stage, tracer, second, 'b')]
+    gevent.joinall(jobs, raise_error=True)
+
+    assert jobs[0].value is first
+    assert jobs[1].value is second
+    for trace, name in ((first, 'a'), (second, 'b')):
+        spans = {span.name: span for span in trace.spans}
+        assert set(spans) == {'compile', name, f'{name}-inner'}
+        assert spans[name].parent_id == trace.root.span_id
+        assert spans[f'{name}-inner'].parent_id == spans[name].span_id
+        assert spans[name].attributes == {'owner': name}
+    # nothing leaks into the hub
+    assert tracer.current() is None
+
+
+def test_wrap_carries_the_span_to_a_thread():
+    tracer = make_tracer()
+    trace = tracer.start('compile', 1)
+
+    def compile_stage():
+        with tracer.span('compile_to_svg') as span:
+            return span
+
+    with tracer.activate(trace), tracer.span('handle_compile') as parent:
+        work = tracer.wrap(compile_stage)
+    result = []
+    thread = threading.Thread(target=lambda: result.append(work()))
+    thread.start()
+    thread.join()
+
+    assert result[0].parent_id == parent.span_id
+    assert tracer.current() is None